@@ -0,0 +1,261 @@
+#!/usr/bin/env python
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import csv
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+import memhier_sim
+
+"""
+    Throughput benchmark for memhier_sim
+    synthetic traces in the R:addr/W:addr format are simulated under the
+    standard stage configurations, one freshly spawned process per run so
+    the peak RSS belongs to that run alone, and accesses per second are
+    reported
+"""
+
+"""geometry shared by every stage: 4 KB pages over a 32 MB virtual space"""
+BASE = {'num_sets_dtlb': 16, 'set_size_dtlb': 4,
+        'num_virtual_pg': 8192, 'num_physical_pg': 1024, 'page_size': 4096,
+        'num_sets_datacache': 256, 'set_size_datacache': 4,
+        'line_size_datacache': 64, 'write_back_datacache': True,
+        'num_sets_l2cache': 1024, 'set_size_l2cache': 8,
+        'line_size_l2cache': 64, 'write_back_l2cache': True}
+
+"""stage configurations, each enabling one more part of the hierarchy"""
+STAGES = [('physical', {'virtual_address': False, 'tlb': False, 'l2_cache': False}),
+          ('va', {'virtual_address': True, 'tlb': False, 'l2_cache': False}),
+          ('va+tlb', {'virtual_address': True, 'tlb': True, 'l2_cache': False}),
+          ('va+tlb+l2', {'virtual_address': True, 'tlb': True, 'l2_cache': True})]
+
+"""bytes of address space the generators stay inside"""
+SPACE = BASE['num_virtual_pg'] * BASE['page_size']
+
+"""start method of the worker processes"""
+SPAWN = multiprocessing.get_context('spawn')
+
+"""result table columns"""
+COLUMNS = ['trace', 'stage', 'accesses', 'seconds', 'accesses_per_sec', 'peak_rss_kb']
+
+
+"""access type of every access, a write with probability write_ratio"""
+def kinds(rng, write_ratio):
+    while True:
+        yield "W" if rng.random() < write_ratio else "R"
+
+
+"""sequential accesses every stride bytes, wrapping around the space"""
+def sequential(n, stride=8, write_ratio=0.25, seed=1):
+    kind = kinds(random.Random(seed), write_ratio)
+    for i in range(n):
+        yield next(kind), (i * stride) % SPACE
+
+
+"""uniformly random 8 byte aligned accesses within a working set"""
+def random_ws(n, working_set=1 << 20, write_ratio=0.25, seed=1):
+    rng = random.Random(seed)
+    kind = kinds(rng, write_ratio)
+    words = min(working_set, SPACE) // 8
+    for i in range(n):
+        yield next(kind), rng.randrange(words) * 8
+
+
+"""follows a random cycle through the lines of a working set, one
+   dependent load after another"""
+def pointer_chase(n, working_set=1 << 20, line=64, write_ratio=0.0, seed=1):
+    rng = random.Random(seed)
+    kind = kinds(rng, write_ratio)
+    order = list(range(min(working_set, SPACE) // line))
+    rng.shuffle(order)
+    for i in range(n):
+        yield next(kind), order[i % len(order)] * line
+
+
+"""touches one line of each of pages pages in turn, more pages than
+   there are physical frames, so every access faults"""
+def page_thrash(n, pages=2 * BASE['num_physical_pg'], write_ratio=0.25, seed=1):
+    kind = kinds(random.Random(seed), write_ratio)
+    page_size = BASE['page_size']
+    pages = min(pages, BASE['num_virtual_pg'])
+    for i in range(n):
+        yield next(kind), (i % pages) * page_size + (i // pages) % (page_size // 64) * 64
+
+
+"""name -> (generator, keyword arguments) of the standard traces, the
+   mixes being the random working set at other write ratios"""
+TRACES = {'sequential': (sequential, {}),
+          'random': (random_ws, {}),
+          'pointer-chase': (pointer_chase, {}),
+          'page-thrash': (page_thrash, {}),
+          'read-only': (random_ws, {'write_ratio': 0.0}),
+          'write-heavy': (random_ws, {'write_ratio': 0.75})}
+
+
+"""writes accesses as an R:addr/W:addr text trace, returns the count"""
+def write_trace(path, accesses):
+    count = 0
+    with open(path, 'w') as f:
+        for kind, address in accesses:
+            f.write("%s:%08x\n" % (kind, address))
+            count += 1
+    return count
+
+
+"""simulates one trace under one stage, in its own process"""
+def run_one(values, trace_file):
+    sim = memhier_sim.MemoryHierarchySimulator(values)
+    start = time.perf_counter()
+    stats = sim.run(trace_file)
+    seconds = time.perf_counter() - start
+    accesses = stats.total_reads + stats.total_writes
+    return accesses, seconds, peak_rss()
+
+
+"""peak resident set size of this process in kilobytes, 0 if unknown"""
+def peak_rss():
+    # linux carries ru_maxrss over exec from the forking parent, while the
+    # VmHWM of the new address space starts afresh
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes everywhere else
+    if sys.platform == 'darwin':
+        rss //= 1024
+    return rss
+
+
+class Benchmark:
+    def __init__(self, traces, stages, accesses, binary=False):
+        self.traces = traces
+        self.stages = stages
+        self.accesses = accesses
+        self.binary = binary
+        self.rows = list()
+
+    """writes every trace into directory, returns name -> file"""
+    def generate(self, directory):
+        files = dict()
+        for name in self.traces:
+            gen, kwargs = TRACES[name]
+            path = os.path.join(directory, name + '.dat')
+            write_trace(path, gen(self.accesses, **kwargs))
+            if self.binary:
+                memhier_sim.BinaryTrace.convert(path, path[:-4] + '.bin')
+                path = path[:-4] + '.bin'
+            files[name] = path
+        return files
+
+    def run(self, directory=None):
+        with tempfile.TemporaryDirectory() as tmp:
+            files = self.generate(directory or tmp)
+            for trace in self.traces:
+                for stage, flags in STAGES:
+                    if stage not in self.stages:
+                        continue
+                    values = dict(BASE)
+                    values.update(flags)
+                    # a spawned process per run keeps the peak rss per run, a
+                    # forked one would start from this process's high-water mark
+                    with ProcessPoolExecutor(max_workers=1, mp_context=SPAWN) as pool:
+                        accesses, seconds, rss = pool.submit(run_one, values, files[trace]).result()
+                    self.rows.append({'trace': trace, 'stage': stage,
+                                      'accesses': accesses, 'seconds': round(seconds, 3),
+                                      'accesses_per_sec': int(accesses / seconds),
+                                      'peak_rss_kb': rss})
+                    self.print_row(self.rows[-1])
+        return self.rows
+
+    def print_header(self):
+        print("%-14s %-10s %10s %9s %12s %10s"
+              % ("Trace", "Stage", "Accesses", "Seconds", "Accesses/s", "Peak RSS"))
+        print("-" * 14 + " " + "-" * 10 + " " + "-" * 10 + " " + "-" * 9
+              + " " + "-" * 12 + " " + "-" * 10)
+
+    def print_row(self, row):
+        print("%-14s %-10s %10d %9.3f %12d %7.1f MB"
+              % (row['trace'], row['stage'], row['accesses'], row['seconds'],
+                 row['accesses_per_sec'], row['peak_rss_kb'] / 1024.0))
+
+    """writes the result table as json or, for any other extension, csv"""
+    def write_results(self, path):
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.json'):
+                json.dump(self.rows, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, fieldnames=COLUMNS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+
+    """compares accesses/s with an earlier result table, returns the
+       (trace, stage, old, new) rows that slowed down by over tolerance"""
+    def regressions(self, path, tolerance):
+        with open(path, newline='') as f:
+            if path.endswith('.json'):
+                old = json.load(f)
+            else:
+                old = list(csv.DictReader(f))
+        old = dict(((r['trace'], r['stage']), float(r['accesses_per_sec'])) for r in old)
+        res = list()
+        for row in self.rows:
+            key = (row['trace'], row['stage'])
+            if key in old and row['accesses_per_sec'] < old[key] * (1 - tolerance):
+                res.append(key + (old[key], row['accesses_per_sec']))
+        return res
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--accesses', type=int, default=200000,
+                        help='Accesses in each synthetic trace.')
+    parser.add_argument('--traces', default=','.join(TRACES),
+                        help='Comma separated traces to run, of ' + ', '.join(TRACES) + '.')
+    parser.add_argument('--stages', default=','.join(s for s, f in STAGES),
+                        help='Comma separated stage configs to run, of '
+                             + ', '.join(s for s, f in STAGES) + '.')
+    parser.add_argument('--binary', action='store_true',
+                        help='Convert the traces to the binary format before simulating.')
+    parser.add_argument('--keep', metavar='DIR',
+                        help='Write the generated traces to DIR instead of a temporary directory.')
+    parser.add_argument('--results', help='Write the result table (.csv or .json).')
+    parser.add_argument('--baseline', help='Earlier result table to check for regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Slowdown against --baseline that counts as a regression.')
+
+    args = parser.parse_args()
+    traces = args.traces.split(',')
+    for name in traces:
+        if name not in TRACES:
+            parser.error('unknown trace ' + name)
+    stages = args.stages.split(',')
+    for name in stages:
+        if name not in dict(STAGES):
+            parser.error('unknown stage ' + name)
+
+    bench = Benchmark(traces, stages, args.accesses, args.binary)
+    bench.print_header()
+    bench.run(args.keep)
+    if args.results:
+        bench.write_results(args.results)
+    if args.baseline:
+        slower = bench.regressions(args.baseline, args.tolerance)
+        for trace, stage, old, new in slower:
+            print("Regression: %s %s %d -> %d accesses/s" % (trace, stage, old, new))
+        if slower:
+            sys.exit(1)
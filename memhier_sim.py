@@ -8,12 +8,73 @@ import argparse
 import glob
 import logging
 import logging.handlers
+import struct
+import mmap
+import hashlib
+import copy
+import tempfile
+import time
+import zlib
+import gzip
+import bz2
+import lzma
+import queue
+import threading
+import csv
+import json
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+from array import array
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+if np is not None:
+    """layout of one binary trace record"""
+    RECORD_DTYPE = np.dtype([('type', 'u1'), ('addr', '<u8')])
+
+"""accesses read from the trace and simulated at a time"""
+CHUNK_SIZE = 65536
+
+"""parsed chunks a compressed trace is read ahead by"""
+PREFETCH_DEPTH = 4
+
+"""stdlib codecs of compressed traces by the magic their files start with"""
+CODECS = [(b'\x1f\x8b', gzip), (b'\xfd7zXZ\x00', lzma), (b'BZh', bz2)]
 
 """
 Class for printing config file
+the values come from a config file, a dict of attribute name -> value,
+or both (the dict overriding the file)
 """
 class Config:
-    def __init__(self, config_file):
+    """values that have to be given when a config is built from a dict"""
+    REQUIRED = ['num_sets_dtlb', 'set_size_dtlb', 'num_virtual_pg',
+                'num_physical_pg', 'page_size', 'num_sets_datacache',
+                'set_size_datacache', 'line_size_datacache', 'num_sets_l2cache',
+                'set_size_l2cache', 'line_size_l2cache']
+
+    """optional config file lines, by label: (attribute, type)"""
+    NAMED = {'page walk levels': ('page_walk_levels', int),
+             'page walk cache': ('page_walk_cache', str),
+             'page walk cache entries': ('pwc_entries', int)}
+
+    """on/off flags read from the config file"""
+    FLAGS = ['write_back_datacache', 'write_back_l2cache', 'virtual_address',
+             'tlb', 'l2_cache']
+
+    """values of the page walk model"""
+    WALK = ['page_walk_levels', 'page_walk_cache', 'pwc_entries']
+
+    """replacement policy of each structure, one of POLICIES"""
+    REPLACEMENT = ['replacement_dtlb', 'replacement_pt', 'replacement_datacache',
+                   'replacement_l2cache']
+
+    def __init__(self, config_file=None, values=None, verbose=True):
         self.config_file = config_file
         # initiate data TLB config
         self.index_dtlb = 0
@@ -43,105 +104,164 @@ class Config:
         self.virtual_address = False
         self.tlb = False
         self.l2_cache = False
-        self.read_config()
+        # initiate replacement policies
+        for name in self.REPLACEMENT:
+            setattr(self, name, 'lru')
+        # initiate page walk model, 0 levels leaves walks unmodelled
+        self.page_walk_levels = 0
+        self.page_walk_cache = 'dc'
+        self.pwc_entries = 16
+        if self.config_file is not None:
+            self.read_config()
+        if values is not None:
+            self.set_values(values)
+        self.check_config()
 
         # calculate index and offsets for perspective values
         self.calculate_values()
 
         # print the config file
-        self.print_config()
-        self.print_header()
+        if verbose:
+            self.print_config()
         
     def read_config(self):
         # counter 
         i = 0
+        # section headers, to place the optional replacement policy lines
+        section = ""
         # read config file
         for line in open(self.config_file):
             if ":" not in line:
+                if line.strip():
+                    section = line.strip()
                 continue
                 
-            value = line.strip().split(":")[1].strip()
-            if i is 0:
+            name, value = [v.strip() for v in line.strip().split(":")[:2]]
+            if name.lower() == "replacement policy":
+                if "TLB" in section:
+                    self.replacement_dtlb = value.lower()
+                elif "Page Table" in section:
+                    self.replacement_pt = value.lower()
+                elif "Data Cache" in section:
+                    self.replacement_datacache = value.lower()
+                elif "L2" in section:
+                    self.replacement_l2cache = value.lower()
+                continue
+            if name.lower() in self.NAMED:
+                attr, kind = self.NAMED[name.lower()]
+                setattr(self, attr, kind(value.lower()))
+                continue
+            if i == 0:
                 self.num_sets_dtlb = int(value)
-                assert self.num_sets_dtlb <= 256, \
-                "The maximum number of sets for the DTLB is 256."
-                assert math.log(self.num_sets_dtlb, 2).is_integer(), \
-                "Number of sets has to be power of 2."
-            elif i is 1:
+            elif i == 1:
                 self.set_size_dtlb = int(value)
-                assert self.set_size_dtlb <= 8, \
-                "The maximum associativity level for DTLB is 8."
-            elif i is 2:
+            elif i == 2:
                 self.num_virtual_pg = int(value)
-                assert self.num_virtual_pg <= 8192, \
-                "The maximum number of virtual pages is 8192."
-                assert math.log(self.num_virtual_pg, 2).is_integer(), \
-                "Number of virtual pages has to be power of 2."
-            elif i is 3:
+            elif i == 3:
                 self.num_physical_pg = int(value)
-                assert self.num_physical_pg <= 1024, \
-                "The maximum number of physical pages is 1024."
-            elif i is 4:
+            elif i == 4:
                 self.page_size = int(value)
-                assert math.log(self.page_size, 2).is_integer(), \
-                "Page size has to be power of 2."
-            elif i is 5:
+            elif i == 5:
                 self.num_sets_datacache = int(value)
-                assert self.num_sets_datacache <= 8192, \
-                "The maximum number of sets for the DC is 8192."
-                assert math.log(self.num_sets_datacache, 2).is_integer(), \
-                "Number of sets has to be power of 2."
-            elif i is 6:
+            elif i == 6:
                 self.set_size_datacache = int(value)
-                assert self.set_size_datacache <= 8, \
-                "The maximum associativity level for DC is 8"
-            elif i is 7:
+            elif i == 7:
                 self.line_size_datacache = int(value)
-                assert self.line_size_datacache >= 8, \
-                "The data line size for the DC should be at least 8."
-                assert math.log(self.line_size_datacache, 2).is_integer(), \
-                "Line size has to be power of 2."
-            elif i is 8:
-                if value is "n":
+            elif i == 8:
+                if value == "n":
                     self.write_back_datacache = True 
                 else:
                     self.write_back_datacache = False
-            elif i is 9:
+            elif i == 9:
                 self.num_sets_l2cache = int(value)
-            elif i is 10:
+            elif i == 10:
                 self.set_size_l2cache = int(value)
-                assert self.set_size_l2cache <= 8, \
-                "The maximum associativity level for L2 is 8"
-            elif i is 11:
+            elif i == 11:
                 self.line_size_l2cache = int(value)
-                assert self.line_size_l2cache >= self.line_size_datacache, \
-                "The data line size for the L2 should be greater than or \
-                equal to that of the DC."
-                assert math.log(self.line_size_l2cache, 2).is_integer(), \
-                "Line size has to be power of 2."
-            elif i is 12:
-                if value is "n":
+            elif i == 12:
+                if value == "n":
                     self.write_back_l2cache = True
                 else:
                     self.write_back_l2cache = False
-            elif i is 13:
-                if value is "n":
+            elif i == 13:
+                if value == "n":
                     self.virtual_address = False
                 else:
                     self.virtual_address = True
-            elif i is 14:
-                if value is "n":
+            elif i == 14:
+                if value == "n":
                     self.tlb = False
                 else:
                     self.tlb = True
-            elif i is 15:
-                if value is "n":
+            elif i == 15:
+                if value == "n":
                     self.l2_cache = False
                 else:
                     self.l2_cache = True 
             # increase counter      
             i += 1
 
+    """sets config values by attribute name"""
+    def set_values(self, values):
+        for name, value in values.items():
+            assert hasattr(self, name), "Unknown config value " + name + "."
+            setattr(self, name, value)
+
+    """checks the configured values against the simulator limits"""
+    def check_config(self):
+        for name in self.REQUIRED:
+            assert getattr(self, name) > 0, "Missing config value " + name + "."
+        assert self.num_sets_dtlb <= 256, \
+        "The maximum number of sets for the DTLB is 256."
+        assert math.log(self.num_sets_dtlb, 2).is_integer(), \
+        "Number of sets has to be power of 2."
+        assert self.num_virtual_pg * self.page_size <= 2 ** 64, \
+        "The virtual address space is limited to 64 bits."
+        assert math.log(self.num_virtual_pg, 2).is_integer(), \
+        "Number of virtual pages has to be power of 2."
+        assert self.num_physical_pg <= 1024, \
+        "The maximum number of physical pages is 1024."
+        assert math.log(self.page_size, 2).is_integer(), \
+        "Page size has to be power of 2."
+        assert self.num_sets_datacache <= 8192, \
+        "The maximum number of sets for the DC is 8192."
+        assert math.log(self.num_sets_datacache, 2).is_integer(), \
+        "Number of sets has to be power of 2."
+        assert self.line_size_datacache >= 8, \
+        "The data line size for the DC should be at least 8."
+        assert math.log(self.line_size_datacache, 2).is_integer(), \
+        "Line size has to be power of 2."
+        assert self.line_size_l2cache >= self.line_size_datacache, \
+        "The data line size for the L2 should be greater than or \
+        equal to that of the DC."
+        assert math.log(self.line_size_l2cache, 2).is_integer(), \
+        "Line size has to be power of 2."
+        for name in self.REPLACEMENT:
+            assert getattr(self, name) in POLICIES, \
+            "The replacement policy has to be one of " + ", ".join(POLICIES) + "."
+        assert 0 <= self.page_walk_levels <= math.log(self.num_virtual_pg, 2), \
+        "A page walk cannot have more levels than virtual page number bits."
+        assert self.page_walk_cache in ['dc', 'pwc'], \
+        "The page walk cache has to be dc (the D-cache and L2) or pwc."
+        assert self.pwc_entries > 0, \
+        "The page walk cache needs at least one entry per level."
+        assert self.replacement_pt != 'plru' or \
+        math.log(self.num_physical_pg, 2).is_integer(), \
+        "Tree PLRU needs a power of 2 number of physical pages."
+
+    """every value a simulation depends on, by attribute name"""
+    def values(self):
+        names = self.REQUIRED + self.FLAGS + self.REPLACEMENT + self.WALK
+        return dict((name, getattr(self, name)) for name in names)
+
+    """returns a copy of the config with some values replaced"""
+    def variant(self, **values):
+        res = copy.copy(self)
+        res.set_values(values)
+        res.check_config()
+        res.calculate_values()
+        return res
+
 
     def calculate_values(self):
         # data-cache calculations
@@ -159,17 +279,28 @@ class Config:
         self.index_pt = int(math.log(float(self.num_virtual_pg), 2))
         self.offset_pt = int(math.log(float(self.page_size), 2))
 
+        # hex digits of an address in the output, 8 up to 32-bit spaces
+        self.address_digits = max(8, -(-(self.index_pt + self.offset_pt) // 4))
+
     """prints each entry into the config file"""
     def print_config(self):
         # data tlb config
         print("Data TLB contains " + str(self.num_sets_dtlb) + " sets.")
         print("Each set contains " + str(self.set_size_dtlb) + " entries.")
+        self.print_replacement(self.replacement_dtlb)
         print("Number of bits used for the index is " + str(self.index_dtlb) + ".\n")
 
         # page table config
         print("Number of virtual pages is " + str(self.num_virtual_pg) + ".")
         print("Number of physical pages is " + str(self.num_physical_pg) + ".")
         print("Each page contains " + str(self.page_size) + " bytes.")
+        self.print_replacement(self.replacement_pt)
+        if self.page_walk_levels:
+            if self.page_walk_cache == 'pwc':
+                where = "a page walk cache of " + str(self.pwc_entries) + " entries per level"
+            else:
+                where = "the D-cache and L2"
+            print("Page walks read " + str(self.page_walk_levels) + " levels through " + where + ".")
         print("Number of bits used for the page table index is " + str(self.index_pt) + ".")
         print("Number of bits used for the page offset is " + str(self.offset_pt) + ".\n")
 
@@ -177,6 +308,7 @@ class Config:
         print("D-cache contains " + str(self.num_sets_datacache) + " sets.")
         print("Each set contains " + str(self.set_size_datacache) + " entries.")
         print("Each line is " + str(self.line_size_datacache) + " bytes.")
+        self.print_replacement(self.replacement_datacache)
         if self.write_back_datacache:
             print("The cache uses a write-allocate and write-back policy.")
         print("Number of bits used for the index is "+ str(self.index_datacache) + ".")
@@ -186,6 +318,7 @@ class Config:
         print("L2-cache contains " + str(self.num_sets_l2cache) + " sets.")
         print("Each set contains " + str(self.set_size_l2cache) + " entries.")
         print("Each line is " + str(self.line_size_l2cache) + " bytes.")
+        self.print_replacement(self.replacement_l2cache)
         if self.write_back_l2cache:
             print("The cache uses a write-allocate and write-back policy.")
 
@@ -204,246 +337,943 @@ class Config:
         if not self.l2_cache:
             print("L2 cache is disabled in this configuration.\n")
 
+    """prints a replacement policy other than the default LRU"""
+    def print_replacement(self, policy):
+        names = {'fifo': 'FIFO', 'plru': 'tree pseudo-LRU', 'srrip': '2-bit SRRIP',
+                 'random': 'random'}
+        if policy != 'lru':
+            print("Replacement uses " + names[policy] + ".")
+
     def print_header(self):
+        # the address column widens past 8 digits for larger address spaces
+        pad = " " * (self.address_digits - 8)
         if self.virtual_address:
-            print("Virtual  Virt.  Page TLB    TLB TLB  PT   Phys        DC  DC          L2  L2")
+            print("Virtual  " + pad + "Virt.  Page TLB    TLB TLB  PT   Phys        DC  DC          L2  L2")
         else:
-            print("Physical Virt.  Page TLB    TLB TLB  PT   Phys        DC  DC          L2  L2")
-        print("Address  Page # Off  Tag    Ind Res. Res. Pg # DC Tag Ind Res. L2 Tag Ind Res.")
-        print("-------- ------ ---- ------ --- ---- ---- ---- ------ --- ---- ------ --- ----")
+            print("Physical " + pad + "Virt.  Page TLB    TLB TLB  PT   Phys        DC  DC          L2  L2")
+        print("Address  " + pad + "Page # Off  Tag    Ind Res. Res. Pg # DC Tag Ind Res. L2 Tag Ind Res.")
+        print("-" * self.address_digits + " ------ ---- ------ --- ---- ---- ---- ------ --- ---- ------ --- ----")
 
         
 class Trace:
-    def __init__(self, trace):
-        self.data = list()
-        """takes all data from trace.dat file and stores it"""
-        self.take_trace()
-        
-    """function to take trace data and create trace data objects"""
+    def __init__(self, trace, chunk_size=CHUNK_SIZE, offset=0, follow=False):
+        self.trace_file = trace
+        """number of accesses handed down the pipeline at a time"""
+        self.chunk_size = chunk_size
+        """byte offset reading starts at, and the offset past the last line read"""
+        self.offset = offset
+        self.end = offset
+        """stop at a last line without its newline, one still being appended"""
+        self.follow = follow
+        """gzip, lzma or bz2 for a compressed trace, None for plain text"""
+        self.codec = trace_codec(trace)
+
+    def __iter__(self):
+        return self.take_trace()
+
+    """generator over the trace file, yields (writes, addresses) chunks"""
+    def take_trace(self):
+        writes = list()
+        addresses = list()
+        opener = self.codec.open if self.codec is not None else open
+        # closed as well when the consumer stops early or raises
+        with opener(self.trace_file, 'rb') as f:
+            f.seek(self.offset)
+            for line in f:
+                if self.follow and not line.endswith(b"\n"):
+                    break
+                self.end += len(line)
+                value = line.strip().split(b":")
+                if len(value) < 2:
+                    continue
+                writes.append(value[0] == b"W")
+                addresses.append(int(value[1], 16))
+                if len(addresses) == self.chunk_size:
+                    yield writes, addresses
+                    writes = list()
+                    addresses = list()
+        if addresses:
+            yield writes, addresses
+
+
+"""the codec module a trace file is compressed with, or None"""
+def trace_codec(trace):
+    with open(trace, 'rb') as f:
+        head = f.read(6)
+    for magic, codec in CODECS:
+        if head.startswith(magic):
+            return codec
+    return None
+
+
+"""
+    Reads a trace ahead in a background thread
+    the chunks of the wrapped trace are produced into a bounded queue, so
+    decompressing and parsing a compressed trace overlap with simulating
+    the chunks before them without the whole trace being held anywhere
+"""
+class PrefetchedTrace:
+    def __init__(self, trace, depth=PREFETCH_DEPTH):
+        self.trace = trace
+        self.depth = depth
+
+    def __iter__(self):
+        return self.take_trace()
+
+    """generator over the chunks the reader thread has queued"""
+    def take_trace(self):
+        chunks = queue.Queue(self.depth)
+        stop = threading.Event()
+        done = object()
+
+        # gives up once the consumer has stopped, instead of blocking forever
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        def produce():
+            try:
+                for chunk in self.trace:
+                    if not put(chunk):
+                        return
+                put(done)
+            except BaseException as e:
+                put(e)
+
+        reader = threading.Thread(target=produce, daemon=True)
+        reader.start()
+        try:
+            while True:
+                item = chunks.get()
+                if item is done:
+                    return
+                if isinstance(item, BaseException):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            reader.join()
+
+
+"""
+    Binary trace file
+    a header (magic, record count, blake2b digest of the records) followed
+    by packed 9 byte records: an access type byte (1 for writes) and the
+    little-endian 64-bit address. The records are memory-mapped and handed
+    to the pipeline without any parsing
+"""
+class BinaryTrace:
+    MAGIC = b'MHTRACE1'
+    HEADER = struct.Struct('<8sQ16s')
+    RECORD = struct.Struct('<BQ')
+
+    def __init__(self, trace, chunk_size=CHUNK_SIZE, start=0):
+        self.trace_file = trace
+        self.chunk_size = chunk_size
+        """index of the first record handed out"""
+        self.start = start
+        with open(self.trace_file, 'rb') as f:
+            magic, self.count, self.digest = self.HEADER.unpack(f.read(self.HEADER.size))
+        assert magic == self.MAGIC, self.trace_file + " is not a binary trace."
+        assert start <= self.count, self.trace_file + " has fewer records than the start."
+
+    def __iter__(self):
+        return self.take_trace()
+
+    """checks whether a file starts with the binary trace magic"""
+    @classmethod
+    def is_binary(cls, trace):
+        with open(trace, 'rb') as f:
+            return f.read(len(cls.MAGIC)) == cls.MAGIC
+
+    """generator over the mapped records, yields (writes, addresses) chunks"""
     def take_trace(self):
-        for line in open(trace):
-            value = line.strip().split(":")
-            dum = TraceLine(value[0], value[1])
-            self.data.append(dum)
+        count = self.count - self.start
+        if count == 0:
+            return
+        if np is not None:
+            records = np.memmap(self.trace_file, dtype=RECORD_DTYPE, mode='r',
+                                offset=self.HEADER.size + self.start * self.RECORD.size,
+                                shape=(count,))
+            for start in range(0, count, self.chunk_size):
+                chunk = records[start:start + self.chunk_size]
+                yield chunk['type'].tolist(), chunk['addr']
+            return
+
+        with open(self.trace_file, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mm)
+            step = self.chunk_size * self.RECORD.size
+            end = self.HEADER.size + self.count * self.RECORD.size
+            for start in range(self.HEADER.size + self.start * self.RECORD.size, end, step):
+                writes = list()
+                addresses = list()
+                for w, a in self.RECORD.iter_unpack(view[start:min(start + step, end)]):
+                    writes.append(w)
+                    addresses.append(a)
+                yield writes, addresses
+            view.release()
+            mm.close()
+
+    """converts a text R:addr/W:addr trace into the binary format"""
+    @classmethod
+    def convert(cls, text_trace, binary_trace):
+        out = BinaryTraceWriter(binary_trace)
+        for writes, addresses in Trace(text_trace):
+            out.write(writes, addresses)
+        return out.close()
 
 
 """
-    Class for taking in the trace data and running functions on this data
+    Writer for the binary trace format
+    records are appended a chunk at a time and the header is filled in
+    with the final count and digest when the writer is closed
+"""
+class BinaryTraceWriter:
+    def __init__(self, trace):
+        self.trace_file = trace
+        self.count = 0
+        self.digest = hashlib.blake2b(digest_size=16)
+        self.f = open(self.trace_file, 'wb')
+        self.f.write(BinaryTrace.HEADER.pack(BinaryTrace.MAGIC, 0, bytes(16)))
+
+    def write(self, writes, addresses):
+        if np is not None:
+            chunk = np.empty(len(addresses), dtype=RECORD_DTYPE)
+            chunk['type'] = writes
+            chunk['addr'] = addresses
+            data = chunk.tobytes()
+        else:
+            record = BinaryTrace.RECORD
+            data = b''.join(record.pack(w, a) for w, a in zip(writes, addresses))
+        self.digest.update(data)
+        self.f.write(data)
+        self.count += len(addresses)
+
+    """fills in the header and closes the file, returns the record count"""
+    def close(self):
+        self.f.seek(0)
+        self.f.write(BinaryTrace.HEADER.pack(BinaryTrace.MAGIC, self.count, self.digest.digest()))
+        self.f.close()
+        return self.count
+
+
+"""opens a trace file in whichever format it is stored, a compressed
+   text trace being decompressed and parsed ahead in a thread"""
+def open_trace(trace, chunk_size=CHUNK_SIZE):
+    if BinaryTrace.is_binary(trace):
+        return BinaryTrace(trace, chunk_size)
+    if trace_codec(trace) is not None:
+        return PrefetchedTrace(Trace(trace, chunk_size))
+    return Trace(trace, chunk_size)
+
+
+"""
+    Class for splitting a whole column of addresses into its fields
+    all shifts and masks are worked out once from the config, and each
+    field is produced for the entire trace in one pass (numpy if present)
+"""
+class AddressDecoder:
+    def __init__(self, config):
+        # page number and offset
+        self.pg_shift = config.offset_pt
+        self.pg_mask = 2 ** config.offset_pt - 1
+        # dtlb
+        self.tlb_shift = config.index_dtlb
+        self.tlb_mask = 2 ** config.index_dtlb - 1
+        # data cache
+        self.dc_shift = config.offset_datacache
+        self.dc_mask = 2 ** config.index_datacache - 1
+        self.dc_tag_shift = config.offset_datacache + config.index_datacache
+        # l2 cache
+        self.l2_shift = config.offset_l2cache
+        self.l2_mask = 2 ** config.index_l2cache - 1
+        self.l2_tag_shift = config.offset_l2cache + config.index_l2cache
+
+    """returns a column of (address >> shift) & mask as python ints"""
+    def field(self, addresses, shift, mask=None):
+        if np is not None:
+            res = np.asarray(addresses, dtype=np.uint64) >> np.uint64(shift)
+            if mask is not None:
+                res &= np.uint64(mask)
+            return res.tolist()
+        if mask is None:
+            return [a >> shift for a in addresses]
+        return [(a >> shift) & mask for a in addresses]
+
+    """virtual page number, page offset, tlb tag and tlb index columns"""
+    def decode_virtual(self, addresses):
+        vpn = self.field(addresses, self.pg_shift)
+        offset = self.field(addresses, 0, self.pg_mask)
+        tlb_tag = self.field(vpn, self.tlb_shift)
+        tlb_ind = self.field(vpn, 0, self.tlb_mask)
+        return vpn, offset, tlb_tag, tlb_ind
+
+    """physical page number, dc tag/index and l2 tag/index columns"""
+    def decode_physical(self, addresses):
+        ppn = self.field(addresses, self.pg_shift)
+        dc_tag = self.field(addresses, self.dc_tag_shift)
+        dc_ind = self.field(addresses, self.dc_shift, self.dc_mask)
+        l2_tag = self.field(addresses, self.l2_tag_shift)
+        l2_ind = self.field(addresses, self.l2_shift, self.l2_mask)
+        return ppn, dc_tag, dc_ind, l2_tag, l2_ind
+
+
+"""
+    Class for streaming the trace data through the memory hierarchy
+    each chunk of accesses is decoded, translated, run through the DC and
+    L2 and printed before the next chunk is read, so memory use does not
+    grow with the length of the trace
 """
 class TraceData:
-    def __init__(self, config, data, stats, pt, tlb):
-        self.data = data
+    def __init__(self, config, trace, stats, pt, tlb, output=None, invalidations=None):
+        self.trace = trace
+        """TraceOutput for the per-access results, None for stats only"""
+        self.output = output
         self.stats = stats
         """config to know how many bits for each"""
         self.config = config
+        self.decoder = AddressDecoder(self.config)
         """page table for physical conversion"""
         self.pt = pt
         self.tlb = tlb
-
-        self.elem, self.ind, self.boolean, self.bool_evic = self.calculate_all()
-        self.dc_tg, self.dc_in, self.l2_tg, self.l2_in = DataCache(self.stats, self.config, self.data).do_cache()
-
-    """function to print all of the values in the given results"""
-    def print_all(self):
-        for val in self.data:
-            if val.accesstype == 'R':
-                with open('trace.log', 'a') as f:
-                    f.write('read at %08x' %val.virtual_address + '\n\n')
-            else:
-                with open('trace.log', 'a') as f:
-                    f.write('write at %08x' %val.virtual_address + '\n\n')
-
-            self.print_line(stats, val.virtual_address, val.virtual_pg_num, 
-                            val.pg_offset, val.tlb_tag, val.tlb_ind, 
-                            val.tlb_res, val.pt_res, val.physical_pg_num, 
-                            val.dc_tag, val.dc_ind, val.dc_res, val.l2_tag, 
-                            val.l2_ind, val.l2_res)
-            
-        """does all necessary calculations for output"""
-        if self.boolean == True and self.bool_evic == 1:
-            with open('trace.log', 'a') as f:
-                f.write('invalidating DC line with tag ' + str(self.dc_tg[self.ind]) + 
-                  ' and index '+ str(self.dc_in[self.ind]) +
-                  ' since phys page ' + str(self.elem) + ' is being replaced' + '\n' +
-                  'invalidating L2 line with tag ' + str(self.l2_tg[self.ind]) +
-                  ' and index ' + str(self.l2_in[self.ind]) +
-                  ' since phys page '+ str(self.elem) + ' is being replaced')
-    
-    """function to calculate different values based on shifts"""
-    def calculate_all(self):
-        i = 0
-        ind = 0
-        element = 0
-        boolean = True
-        bool_evic = True
-        ppn_list = []
-
-        for val in self.data: 
-            # virtual page
-            self.calc_virtual_pg_num(val)
-            self.calc_pg_offset(val)
-
-            # tlb 
-            self.calc_tlb_tag(val)
-            self.calc_tlb_index(val)
-
+        self.dc = DataCache(self.stats, self.config)
+
+        # trace position of the first access of the current chunk
+        self.position = 0
+        # byte offset past the last line of a text trace an append run read
+        self.offset = 0
+        # (index in chunk, frame) of every page replacement in the chunk
+        self.replaced = list()
+        # (trace position, frame) replacements made outside this pipeline,
+        # used when the physical stream was split up after translation
+        self.invalidations = deque(invalidations or ())
+        # index in chunk -> (frame, lines invalidated) for the log
+        self.invalidated = dict()
+        # (index in chunk, pte addresses) of the chunk's page walks
+        self.walks = list()
+        self.dc.walker = pt.walker
+        if self.config.tlb:
+            pt.tlb = tlb
+        """IntervalStats collecting per-window counters, or None"""
+        self.windows = None
+        """Checkpointer saving the state every so many accesses, or None"""
+        self.checkpoints = None
+
+    """runs every chunk of the trace through the pipeline"""
+    def run(self, trace=None):
+        if trace is not None:
+            self.trace = trace
+        chunks = self.trace
+        if self.windows is not None:
+            chunks = self.windows.split(chunks)
+        if self.checkpoints is not None:
+            chunks = self.checkpoints.split(chunks)
+        if self.output is not None:
+            self.output.header()
+        for writes, addresses in chunks:
+            rows = self.calculate_all(writes, addresses)
+            if self.output is not None:
+                self.output.write_chunk(rows, self.invalidated)
+        if self.output is not None:
+            self.output.close()
+
+    """translates one chunk, returns the virtual fields, tlb/pt results and physical addresses"""
+    def translate(self, addresses):
+        n = len(addresses)
+        # decode the virtual side of the chunk in one pass
+        vpn, offset, tlb_tag, tlb_ind = self.decoder.decode_virtual(addresses)
+        if not isinstance(addresses, list):
+            addresses = addresses.tolist()
+        tlb_res = [""] * n
+        pt_res = [""] * n
+        phys = addresses
+        self.replaced = replaced = list()
+        # (index in chunk, pte addresses) of every modelled page walk
+        self.walks = walks = list()
+        walker = self.pt.walker
+        stats = self.stats
+
+        if self.config.tlb or self.config.virtual_address:
+            phys = list(addresses)
+            shift = self.config.offset_pt
+            # an access to the page of the one before it is a tlb hit, or
+            # without a tlb a page table hit, that leaves the recency as is
             if self.config.tlb:
-                # if hit then don't go to pagetable
-                val.hexaddress = self.tlb.check_tlb(val)
-                
-            if self.config.virtual_address:
-                #virtual to physical address conversion
-                add, bool_evic, ppn = self.pt.convert_to_phy(val)
-                val.hexaddress = add
-                ppn_list.append(ppn)
-                
-            self.calc_physical_pg_num(val)
-                        
-            if self.config.virtual_address:
-                ''' Check if given list contains any duplicates '''  
-                setOfElems = set()
-                for e1 in ppn_list:
-                    if e1 in setOfElems:
-                        boolean = True
-                        ind = ppn_list.index(e1)
-                        element = e1
+                same_page = self.tlb.lines.REPEAT_HIT_FREE
+            else:
+                same_page = walker is None and self.pt.phys_table.frames.REPEAT_HIT_FREE
+            last_vpn = -1
+            frame = -1
+            for i in range(n):
+                if vpn[i] == last_vpn:
+                    if self.config.tlb:
+                        stats.dtlb_hits += 1
+                        tlb_res[i] = "hit "
                     else:
-                        setOfElems.add(e1)    
-                        boolean = False
-                        ind = ppn_list.index(e1)
-                        element = e1
-            i += 1
-        
-        return element, ind, boolean, bool_evic
+                        stats.pt_refs += 1
+                        stats.pt_hits += 1
+                        pt_res[i] = "hit "
+                    if self.config.virtual_address:
+                        phys[i] = (frame << shift) | offset[i]
+                    continue
+                if same_page:
+                    last_vpn = vpn[i]
+                frame = -1
+                if self.config.tlb:
+                    frame = self.tlb.check_tlb(tlb_ind[i], tlb_tag[i])
+                    tlb_res[i] = "hit " if frame != -1 else "miss"
+
+                if not self.config.virtual_address:
+                    # physical addresses translate to themselves
+                    if frame == -1:
+                        self.tlb.fill(tlb_ind[i], tlb_tag[i], vpn[i])
+                elif frame != -1:
+                    # a tlb hit translates without the page table
+                    phys[i] = (frame << shift) | offset[i]
+                else:
+                    #virtual to physical address conversion
+                    phys[i], pt_res[i], bool_evic, ppn = \
+                        self.pt.convert_to_phy(vpn[i], offset[i])
+                    if bool_evic:
+                        replaced.append((i, ppn))
+                    if walker is not None:
+                        walks.append((i, walker.addresses(vpn[i])))
+                    if self.config.tlb:
+                        self.tlb.fill(tlb_ind[i], tlb_tag[i], ppn)
+                    frame = ppn
+
+        return addresses, vpn, offset, tlb_tag, tlb_ind, tlb_res, pt_res, phys
+
+    """adds the outside replacements falling in the next n accesses to
+       the chunk's own and moves the trace position past the chunk"""
+    def take_events(self, n):
+        events = self.replaced
+        end = self.position + n
+        while self.invalidations and self.invalidations[0][0] < end:
+            pos, frame = self.invalidations.popleft()
+            events.append((pos - self.position, frame))
+        self.position = end
+        return events
+
+    """function to run one chunk through translation, dc and l2"""
+    def calculate_all(self, writes, addresses):
+        addresses, vpn, offset, tlb_tag, tlb_ind, tlb_res, pt_res, phys = \
+            self.translate(addresses)
+        events = self.take_events(len(writes))
+
+        # decode the physical side once the chunk is translated
+        ppn, dc_tag, dc_ind, l2_tag, l2_ind = self.decoder.decode_physical(phys)
+        dc_res, l2_res, self.invalidated = \
+            self.dc.do_cache(writes, dc_tag, dc_ind, l2_tag, l2_ind, events, self.walks)
+
+        return zip(writes, addresses, vpn, offset, tlb_tag, tlb_ind, tlb_res,
+                   pt_res, ppn, dc_tag, dc_ind, dc_res, l2_tag, l2_ind, l2_res)
+
+    """functional warming of one chunk: the tlb, page table and caches
+       are updated exactly as calculate_all would, but nothing is counted
+       and no per-access results are built"""
+    def warm(self, writes, addresses):
+        self.replaced = list()
+        self.walks = list()
+        walker = self.pt.walker
+        phys = addresses
+        if self.config.tlb or self.config.virtual_address:
+            vpn, offset, tlb_tag, tlb_ind = self.decoder.decode_virtual(addresses)
+            tlb = self.tlb if self.config.tlb else None
+            map_page = self.pt.map_page
+            shift = self.config.offset_pt
+            phys = [0] * len(vpn)
+            for i in range(len(vpn)):
+                frame = -1
+                if tlb is not None:
+                    frame = tlb.translate(tlb_ind[i], tlb_tag[i])
+                if not self.config.virtual_address:
+                    if frame == -1:
+                        tlb.fill(tlb_ind[i], tlb_tag[i], vpn[i])
+                    phys[i] = addresses[i]
+                    continue
+                if frame == -1:
+                    frame, replaced = map_page(vpn[i])
+                    if replaced:
+                        self.replaced.append((i, frame))
+                    if walker is not None:
+                        self.walks.append((i, walker.addresses(vpn[i])))
+                    if tlb is not None:
+                        tlb.fill(tlb_ind[i], tlb_tag[i], frame)
+                phys[i] = (frame << shift) | offset[i]
+        events = self.take_events(len(writes))
+
+        ppn, dc_tag, dc_ind, l2_tag, l2_ind = self.decoder.decode_physical(phys)
+        self.dc.warm(writes, dc_tag, dc_ind, l2_tag, l2_ind, events, self.walks)
 
 
-    """function for printing all data"""
-    def print_line(self, stats, hexaddress, virtual_pg_num, pg_offset, 
-                   tlb_tag, tlb_ind, tlb_res, pt_res, physical_pg_num, dc_tag, 
-                   dc_ind, dc_res, l2_tag, l2_ind, l2_res):
-             
-        if tlb_res == "hit ":
-            pt_res = ""
-        elif self.config.virtual_address:
-            pt_res = pt_res
-                
-        if not self.config.virtual_address and not self.config.tlb and not self.config.l2_cache:
-            l2_tag = ""
-            l2_ind = ""
-            l2_res = ""
-            tlb_tag = ""
-            tlb_ind = ""
-            tlb_res = ""
-            pt_res = ""
-            virtual_pg_num = ""
-            print('%08x' % hexaddress,'%6s' % virtual_pg_num,'%4x' % pg_offset,
-                 '%6s %3s %4s' % (tlb_tag, tlb_ind, tlb_res),
-                 '%4s' % pt_res,'%4x %6x %3x %4s' % (physical_pg_num, dc_tag, dc_ind, dc_res),
-                 '%6s %3s %4s' % (l2_tag, l2_ind, l2_res),)
+"""
+    Output layer for the per-access table and trace.log
+    a chunk of rows is formatted at once and written through buffered
+    files. The mode picks the rows: every row (full), every Nth row
+    (sample), rows that missed anywhere (misses); stats-only runs do not
+    create an output at all
+"""
+class TraceOutput:
+    MODES = ['full', 'sample', 'misses', 'stats']
 
-        if not self.config.virtual_address and not self.config.tlb and self.config.l2_cache:
-            tlb_tag = ""
-            tlb_ind = ""
-            tlb_res = ""
-            pt_res = ""
+    def __init__(self, config, mode='full', every=1000, log_file='trace.log'):
+        assert mode in self.MODES, "Unknown output mode " + mode + "."
+        self.config = config
+        self.mode = mode
+        self.every = every
+        self.out = sys.stdout
+        self.log_file = log_file
+        self.log = None
+        # the log is started afresh by the first run and added to by later ones
+        self.log_mode = 'w'
+        # rows seen so far, for sampling
+        self.count = 0
+
+    """opens the log and prints the table header"""
+    def header(self):
+        if self.log is None:
+            self.log = open(self.log_file, self.log_mode, buffering=1 << 20)
+            self.log_mode = 'a'
+        self.config.print_header()
+
+    """writes the selected rows of a chunk and its invalidation entries"""
+    def write_chunk(self, rows, invalidated):
+        lines = list()
+        log = list()
+        digits = self.config.address_digits
+        for i, row in enumerate(rows):
+            wanted = self.wanted(row)
+            if wanted:
+                if row[0]:
+                    log.append('write at %0*x\n\n' % (digits, row[1]))
+                else:
+                    log.append('read at %0*x\n\n' % (digits, row[1]))
+                lines.append(self.format_row(row))
+            if i in invalidated:
+                log.append(self.format_invalidation(*invalidated[i]))
+        self.log.write(''.join(log))
+        if lines:
+            self.out.write('\n'.join(lines) + '\n')
+
+    """whether a row is written in the current mode"""
+    def wanted(self, row):
+        self.count += 1
+        if self.mode == 'sample':
+            return self.count % self.every == 1 or self.every == 1
+        if self.mode == 'misses':
+            return row[11] == "miss" or row[6] == "miss" or row[7] == "miss"
+        return True
+
+    """function for formatting one row of the table"""
+    def format_row(self, row):
+        (write, hexaddress, virtual_pg_num, pg_offset, tlb_tag, tlb_ind,
+         tlb_res, pt_res, physical_pg_num, dc_tag, dc_ind, dc_res, l2_tag,
+         l2_ind, l2_res) = row
+        if self.config.virtual_address:
+            virtual_pg_num = '%x' % virtual_pg_num
+        else:
             virtual_pg_num = ""
-            print('%08x' % hexaddress,'%6s' % virtual_pg_num,'%4x' % pg_offset,
-                 '%6s %3s %4s' % (tlb_tag, tlb_ind, tlb_res),
-                 '%4s' % pt_res,'%4x %6x %3x %4s' % (physical_pg_num, dc_tag, dc_ind, dc_res),
-                 '%6s %3s %4s' % (l2_tag, l2_ind, l2_res),)
-
-        if self.config.virtual_address and not self.config.tlb and self.config.l2_cache:
+        if self.config.tlb:
+            tlb_tag = '%x' % tlb_tag
+            tlb_ind = '%x' % tlb_ind
+        else:
             tlb_tag = ""
             tlb_ind = ""
-            tlb_res = ""
+        # the page table is not consulted on a tlb hit
+        if tlb_res == "hit " or not self.config.virtual_address:
             pt_res = ""
-            print('%08x' % hexaddress,'%6x' % virtual_pg_num,'%4x' % pg_offset,
-                 '%6s %3s %4s' % (tlb_tag, tlb_ind, tlb_res),
-                 '%4s' % pt_res,'%4x %6x %3x %4s' % (physical_pg_num, dc_tag, dc_ind, dc_res),
-                 '%6s %3s %4s' % (l2_tag, l2_ind, l2_res),)
-        
-        if self.config.virtual_address and self.config.tlb and self.config.l2_cache: 
-            print('%08x' % hexaddress,'%6x' % virtual_pg_num,'%4x' % pg_offset,
-                 '%6x %3x %4s' % (tlb_tag, tlb_ind, tlb_res),
-                 '%4s' % pt_res,'%4x %6x %3x %4s' % (physical_pg_num, dc_tag, dc_ind, dc_res),
-                 '%6s %3s %4s' % (l2_tag, l2_ind, l2_res),)
-                
-    """virtual page number"""  
-    def calc_virtual_pg_num(self, val):
-        # calculate size of the pg_num
-        size = config.offset_pt
-        mask = 2 ** 32 - 1
-        mask = mask << size
-        res = val.hexaddress & mask
-        val.virtual_pg_num = res >> size
-
-    """page offset"""
-    def calc_pg_offset(self, val):
-        offset = config.offset_pt
-        mask = 2 ** offset - 1
-        val.pg_offset = val.hexaddress & mask
-
-    """tag for tlb"""
-    def calc_tlb_tag(self, val):
-        shift = config.index_dtlb
-        mask = sys.maxsize
-        mask = mask << shift
-        res = val.virtual_pg_num & mask
-        res = res >> shift
-        val.tlb_tag = res
-
-    """index for tlb"""
-    def calc_tlb_index(self, val):
-        mask = 2 ** config.index_dtlb - 1
-        res = val.virtual_pg_num & mask
-        val.tlb_ind = res
-    
-    """calculates the physical page number"""
-    def calc_physical_pg_num(self, val):
-        size = config.offset_pt
-        mask = 2 ** 32 - 1
-        mask = mask << size
-        res = val.hexaddress & mask
-        val.physical_pg_num = res >> size
-
-    """offset for data cache"""
-    def calc_dc_offset(self, val):
-        mask = 2 ** config.d_cache_offset - 1
-        res = val.virtual_address & mask
-        val.dc_offset = res
+        return ('%0*x %6s %4x %6s %3s %4s %4s %4x %6x %3x %4s %6s %3s %4s' %
+                (self.config.address_digits, hexaddress, virtual_pg_num, pg_offset, tlb_tag, tlb_ind,
+                 tlb_res, pt_res, physical_pg_num, dc_tag, dc_ind, dc_res,
+                 l2_tag, l2_ind, l2_res))
+
+    """log entries for the dc/l2 lines invalidated by a page replacement"""
+    def format_invalidation(self, frame, lines):
+        res = ''
+        for cache, tag, ind in lines:
+            res += ('invalidating ' + cache + ' line with tag ' + str(tag) +
+                    ' and index ' + str(ind) + ' since phys page ' +
+                    str(frame) + ' is being replaced' + '\n')
+        if lines:
+            res += '\n'
+        return res
+
+    def close(self):
+        self.log.close()
+        self.log = None
+        self.out.flush()
+
 
-        
 """
-    class for storing each trace data entry
+    Interval statistics for phase analysis
+    the counters are snapshotted into one flat array every interval
+    accesses. Chunks are cut at the interval boundaries so a snapshot
+    always lands exactly on one; the per-window counts are the
+    differences between consecutive snapshots
 """
-class TraceLine:
-    def __init__(self, accesstype, hexaddress):
-        self.accesstype = accesstype
-        self.hexaddress = int(hexaddress, 16)
+class IntervalStats:
+    def __init__(self, stats, interval, start=0):
+        assert interval > 0, "The statistics interval has to be positive."
+        self.stats = stats
+        self.interval = interval
+        # accesses left until the next snapshot, start is the trace
+        # position when resuming from a checkpoint
+        self.remaining = interval - start % interval
+        self.accesses = start
+        # access count followed by every counter, one record per snapshot
+        self.samples = array('q')
+        self.snapshot()
+
+    def snapshot(self):
+        self.samples.append(self.accesses)
+        self.samples.extend([getattr(self.stats, name) for name in Statistics.COUNTERS])
+
+    """generator cutting a trace's chunks at the interval boundaries,
+       snapshotting once each piece has been simulated"""
+    def split(self, trace):
+        for writes, addresses in trace:
+            start = 0
+            while start < len(addresses):
+                step = min(len(addresses) - start, self.remaining)
+                yield writes[start:start + step], addresses[start:start + step]
+                start += step
+                self.accesses += step
+                self.remaining -= step
+                if self.remaining == 0:
+                    self.snapshot()
+                    self.remaining = self.interval
+        # last, partial window
+        if self.remaining != self.interval:
+            self.snapshot()
+            self.remaining = self.interval
+
+    """returns one [accesses so far, counter deltas...] row per window"""
+    def windows(self):
+        width = len(Statistics.COUNTERS) + 1
+        s = self.samples
+        res = list()
+        for base in range(width, len(s), width):
+            row = [s[base]]
+            for i in range(1, width):
+                row.append(s[base + i] - s[base - width + i])
+            res.append(row)
+        return res
+
+    def write_csv(self, path):
+        with open(path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(['accesses'] + Statistics.COUNTERS)
+            writer.writerows(self.windows())
 
-        self.virtual_address = self.hexaddress
 
-        self.virtual_pg_num = ""
-        self.pg_offset = ""
-        
-        self.tlb_tag = ""
-        self.tlb_ind = ""
-        self.tlb_res = ""
+"""
+    Per-stage profiler of the access path
+    the stage functions of one pipeline are replaced, on those instances
+    only, by wrappers adding up calls and wall time, so nothing at all is
+    added when profiling is off. The cost of the timer itself is measured
+    on an empty function and taken off every call
+"""
+class StageProfiler:
+    def __init__(self):
+        # stage name -> [calls, nanoseconds]
+        self.counts = dict()
+        self.total = 0
+        self.overhead = 0
+        empty = self.wrap('empty', lambda: None)
+        for i in range(100000):
+            empty()
+        calls, ns = self.counts.pop('empty')
+        self.overhead = ns / calls
+
+    """returns func wrapped to count into stage name"""
+    def wrap(self, name, func):
+        count = self.counts.setdefault(name, [0, 0])
+        clock = time.perf_counter_ns
+        def timed(*args):
+            start = clock()
+            res = func(*args)
+            count[1] += clock() - start
+            count[0] += 1
+            return res
+        return timed
+
+    """instruments the stages of a TraceData"""
+    def attach(self, pipeline):
+        decoder = pipeline.decoder
+        decoder.decode_virtual = self.wrap('decode', decoder.decode_virtual)
+        decoder.decode_physical = self.wrap('decode', decoder.decode_physical)
+        pipeline.tlb.check_tlb = self.wrap('TLB.check_tlb', pipeline.tlb.check_tlb)
+        pipeline.pt.convert_to_phy = self.wrap('PageTable.convert_to_phy',
+                                               pipeline.pt.convert_to_phy)
+        dc = pipeline.dc
+        dc.find_in_cache = self.wrap('DataCache.find_in_cache', dc.find_in_cache)
+        dc.l2.find_in_cache = self.wrap('L2Cache.find_in_cache', dc.l2.find_in_cache)
+        # page replacement invalidations, not part of any stage above
+        dc.invalidate_frame = self.wrap('DataCache.invalidate_frame', dc.invalidate_frame)
+        if pipeline.output is not None:
+            pipeline.output.write_chunk = self.wrap('output', pipeline.output.write_chunk)
+
+    """runs func(*args) counting its wall time as the total"""
+    def measure(self, func, *args):
+        start = time.perf_counter_ns()
+        res = func(*args)
+        self.total += time.perf_counter_ns() - start
+        return res
+
+    def print_stats(self):
+        print("\nStage profile\n")
+        print("Stage                           Calls    Seconds   ns/call  Share")
+        print("-------------------------- ---------- ---------- --------- ------")
+        total = max(self.total, 1)
+        measured = 0
+        for name, (calls, ns) in self.counts.items():
+            measured += ns
+            ns = max(0, ns - calls * self.overhead)
+            print("%-26s %10d %10.3f %9.0f %5.1f%%"
+                  % (name, calls, ns / 1e9, ns / calls if calls else 0, 100.0 * ns / total))
+        # loops, result columns and the timer calls themselves
+        other = max(0, self.total - measured)
+        print("%-26s %10s %10.3f %9s %5.1f%%" % ("other", "", other / 1e9, "", 100.0 * other / total))
+        print("%-26s %10s %10.3f" % ("total", "", self.total / 1e9))
+        print("\ntimer overhead of %.0f ns per call taken off each stage" % self.overhead)
 
-        self.pt_res = ""
 
-        self.physical_pg_num = ""
+"""
+    Checkpoint of the complete simulator state
+    a small JSON header (config, counters, trace position, pending page
+    replacements and the layout of the arrays) followed by the raw bytes
+    of every TLB, page table, DC and L2 array, zlib compressed. A
+    checkpoint either resumes the run it was taken from or warms up the
+    hierarchy for other runs of the same geometry
+"""
+class Checkpoint:
+    MAGIC = b'MHCKPT01'
+    HEADER = struct.Struct('<8sI')
+
+    """the parts of a simulator that carry state, by name"""
+    @staticmethod
+    def parts(sim):
+        res = [('tlb', sim.tlb), ('pt', sim.pagetable),
+               ('frames', sim.pagetable.phys_table.frames),
+               ('dc', sim.pipeline.dc.lines), ('l2', sim.pipeline.dc.l2.lines)]
+        if sim.pagetable.walker is not None:
+            res.append(('walk', sim.pagetable.walker))
+        return res
+
+    """writes the state of a simulator to path"""
+    @classmethod
+    def save(cls, sim, path):
+        arrays = list()
+        for prefix, part in cls.parts(sim):
+            for name, values in part.state().items():
+                arrays.append((prefix + '.' + name, values))
+        meta = {'byteorder': sys.byteorder,
+                'config': sim.config.values(),
+                'position': sim.pipeline.position,
+                'offset': sim.pipeline.offset,
+                'counters': sim.stats.counters(),
+                'walk': sim.stats.walk,
+                'invalidations': list(sim.pipeline.invalidations),
+                # bytearrays are stored as arrays of unsigned bytes
+                'arrays': [[name, getattr(values, 'typecode', 'B'), len(values)]
+                           for name, values in arrays]}
+        header = json.dumps(meta).encode()
+        data = zlib.compress(b''.join(values for name, values in arrays))
+        # written aside and renamed, so a crash never leaves a torn checkpoint
+        tmp = str(path) + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(cls.HEADER.pack(cls.MAGIC, len(header)))
+            f.write(header)
+            f.write(data)
+        os.replace(tmp, path)
+
+    """reads a checkpoint into a simulator with the same geometry
+       a warm start takes only the TLB, page table and cache contents and
+       leaves the counters and trace position at zero, so unlike a resume
+       it may go on under other address, TLB, L2 and write policy flags"""
+    @classmethod
+    def load(cls, sim, path, warm=False):
+        with open(path, 'rb') as f:
+            magic, size = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            assert magic == cls.MAGIC, str(path) + " is not a checkpoint."
+            meta = json.loads(f.read(size))
+            data = zlib.decompress(f.read())
+        assert meta['byteorder'] == sys.byteorder, \
+        "The checkpoint was written on a machine of the other byte order."
+        names = Config.REQUIRED + Config.REPLACEMENT + Config.WALK
+        if not warm:
+            names = names + Config.FLAGS
+        for name in names:
+            assert meta['config'].get(name) == getattr(sim.config, name), \
+            "The checkpoint was taken with a different " + name + "."
+
+        state = dict()
+        start = 0
+        for name, typecode, length in meta['arrays']:
+            values = array(typecode)
+            end = start + length * values.itemsize
+            values.frombytes(data[start:end])
+            prefix, name = name.split('.')
+            state.setdefault(prefix, dict())[name] = values
+            start = end
+        for prefix, part in cls.parts(sim):
+            part.restore(state[prefix])
+
+        if warm:
+            return
+        for name, value in meta['counters'].items():
+            setattr(sim.stats, name, value)
+        sim.stats.walk[:] = meta['walk']
+        sim.pipeline.position = meta['position']
+        sim.pipeline.offset = meta.get('offset', 0)
+        sim.pipeline.invalidations = deque(tuple(e) for e in meta['invalidations'])
 
-        self.dc_tag = ""
-        self.dc_ind = ""
-        self.dc_res = ""
 
-        self.l2_tag = ""
-        self.l2_ind = ""
-        self.l2_res = ""
+"""
+    Saves a checkpoint every so many accesses of a run
+    the trace's chunks are cut at every multiple of the interval, and the
+    checkpoint is taken between the pieces, where the state is consistent
+"""
+class Checkpointer:
+    def __init__(self, sim, path, every):
+        assert every > 0, "The checkpoint interval has to be positive."
+        self.sim = sim
+        self.path = path
+        self.every = every
+        self.next = sim.pipeline.position - sim.pipeline.position % every + every
+
+    def update(self, position):
+        if position >= self.next:
+            self.sim.checkpoint(self.path)
+            self.next = position - position % self.every + self.every
+
+    """generator cutting a trace's chunks at the checkpoint positions,
+       saving once the piece before each one has been simulated"""
+    def split(self, trace):
+        pipeline = self.sim.pipeline
+        for writes, addresses in trace:
+            start = 0
+            while start < len(addresses):
+                step = min(len(addresses) - start, self.next - pipeline.position)
+                yield writes[start:start + step], addresses[start:start + step]
+                start += step
+                self.update(pipeline.position)
+
+
+"""
+    Single pass D-cache sweep using LRU stack distances (Mattson et al.)
+    the trace is translated once and, for every set count, each access is
+    looked up in its set's recency stack. The depth it is found at is its
+    stack distance, so a cache with that many sets hits for every
+    associativity above the distance. Stacks are cut off at max_ways since
+    deeper entries miss in every associativity that is reported.
+    Invalidating the lines of a replaced page leaves a free way in some
+    cache sizes and not others, which no single stack can express, so
+    the sweep stops at the first page replacement
+"""
+class StackDistanceSweep:
+    def __init__(self, config, trace, stats, pt, tlb, set_counts, max_ways):
+        assert config.write_back_datacache, \
+        "The D-cache sweep needs a write-allocate D-cache."
+        assert config.replacement_datacache == 'lru', \
+        "The D-cache sweep needs LRU replacement."
+        assert not config.page_walk_levels, \
+        "The D-cache sweep does not model page walks."
+        for sets in set_counts:
+            assert math.log(sets, 2).is_integer(), \
+            "Number of sets has to be power of 2."
+        self.config = config
+        self.stats = stats
+        self.set_counts = sorted(set_counts)
+        self.max_ways = max_ways
+        # reuse the pipeline's decode and translation stages
+        self.pipeline = TraceData(config, trace, stats, pt, tlb)
+        self.stacks = [[list() for i in range(sets)] for sets in self.set_counts]
+        # distance histogram per set count, the last bucket counts misses
+        # at every reported associativity
+        self.hist = [[0] * (max_ways + 1) for sets in self.set_counts]
+
+    def run(self):
+        offset = self.config.offset_datacache
+        for writes, addresses in self.pipeline.trace:
+            phys = self.pipeline.translate(addresses)[-1]
+            assert not self.pipeline.replaced, \
+            "The D-cache sweep does not model the invalidations of page replacements."
+            lines = self.pipeline.decoder.field(phys, offset)
+            for w in writes:
+                if w:
+                    self.stats.total_writes += 1
+                else:
+                    self.stats.total_reads += 1
+            for k in range(len(self.set_counts)):
+                self.update(lines, k)
+
+    """pushes a chunk of line addresses through the stacks of one set count"""
+    def update(self, lines, k):
+        sets = self.set_counts[k]
+        mask = sets - 1
+        bits = int(math.log(sets, 2))
+        stacks = self.stacks[k]
+        hist = self.hist[k]
+        max_ways = self.max_ways
+        for line in lines:
+            tag = line >> bits
+            stack = stacks[line & mask]
+            try:
+                dist = stack.index(tag)
+                del stack[dist]
+            except ValueError:
+                dist = max_ways
+                if len(stack) == max_ways:
+                    stack.pop()
+            stack.insert(0, tag)
+            hist[dist] += 1
+
+    """returns (sets, ways, hits, misses) for every swept configuration"""
+    def results(self):
+        res = list()
+        for k in range(len(self.set_counts)):
+            hits = 0
+            total = sum(self.hist[k])
+            for ways in range(1, self.max_ways + 1):
+                hits += self.hist[k][ways - 1]
+                res.append((self.set_counts[k], ways, hits, total - hits))
+        return res
+
+    def print_stats(self):
+        print("\nD-cache sweep with " + str(self.config.line_size_datacache) + " byte lines\n")
+        print("  Sets Ways   Size    dc hits  dc misses dc hit ratio")
+        print("------ ---- ------ ---------- ---------- ------------")
+        for sets, ways, hits, misses in self.results():
+            ratio = float(hits) / (hits + misses) if hits + misses else 0.0
+            print('%6d %4d %6d %10d %10d %12.6f' % (sets, ways,
+                  sets * ways * self.config.line_size_datacache, hits, misses, ratio))
+
+        # translation and access counts are the same for every configuration
+        print("")
+        print('dtlb hits        : ' + str(self.stats.dtlb_hits))
+        print('dtlb misses      : ' + str(self.stats.dtlb_misses))
+        print('pt hits          : ' + str(self.stats.pt_hits))
+        print('pt faults        : ' + str(self.stats.pt_faults))
+        print('Total reads      : ' + str(self.stats.total_reads))
+        print('Total writes     : ' + str(self.stats.total_writes))
+        print('page table refs  : ' + str(self.stats.pt_refs))
+        print('disk refs        : ' + str(self.stats.disk_refs))
 
 
 class Statistics:
+    """names of all the counters, in print order"""
+    COUNTERS = ['dtlb_hits', 'dtlb_misses', 'pt_hits', 'pt_faults',
+                'dc_hits', 'dc_misses', 'l2_hits', 'l2_misses',
+                'total_reads', 'total_writes', 'main_mem_refs', 'pt_refs',
+                'disk_refs']
 
     def __init__(self, config):
 
@@ -468,20 +1298,29 @@ class Statistics:
         self.pt_refs = 0
         self.disk_refs = 0
 
+        # per level page walk counters and the PageWalk printing them,
+        # set up by the page table when walks are modelled
+        self.walk = list()
+        self.walker = None
+
+    """returns all the counters as a dict"""
+    def counters(self):
+        return dict((name, getattr(self, name)) for name in self.COUNTERS)
+
     def print_stats(self):
 
         print("\nSimulation statistics\n")
 
         print('dtlb hits        : ' + str(self.dtlb_hits))
         print('dtlb misses      : ' + str(self.dtlb_misses))
-        if config.tlb:
+        if self.config.tlb:
             print('dtlb hit ratio   : %6.6f\n' % (float(self.dtlb_hits)/(self.dtlb_hits + self.dtlb_misses)))
         else:
             print('dtlb hit ratio   : N/A\n')
 
         print('pt hits          : ' + str(self.pt_hits))
         print('pt faults        : ' + str(self.pt_faults))
-        if config.virtual_address:
+        if self.config.virtual_address:
             print('pt hit ratio     : %6.6f\n' % (float(self.pt_hits)/(self.pt_hits+self.pt_faults)))
         else:
             print('pt hit ratio     : N/A\n')
@@ -492,7 +1331,7 @@ class Statistics:
 
         print('L2 hits          : ' + str(self.l2_hits))
         print('L2 misses        : ' + str(self.l2_misses))
-        if config.l2_cache:
+        if self.config.l2_cache:
             print('L2 hit ratio     : %6.6f\n' % (float(self.l2_hits)/(self.l2_hits + self.l2_misses)))
         else:
             print('L2 hit ratio     : N/A\n')
@@ -505,527 +1344,1233 @@ class Statistics:
         print('page table refs  : ' + str(self.pt_refs))
         print('disk refs        : ' + str(self.disk_refs))
 
+        if self.walker is not None:
+            self.walker.print_stats()
+
   
 """
-    class for data cache entries
+    Re-entrant front end for the simulator
+    owns one set of TLB, page table, cache and statistics state and keeps
+    it between calls to run, so it can be driven in-process any number of
+    times without the command line or any module level state
 """
-class DataCacheEntry:
-    def __init__(self, v, tag, l2_tag):
-        self.v = v
-        self.tag = tag
-        self.lru = 0
-        self.l2_tag = l2_tag
-        
-    def __str__(self):
-        return str(str(self.v) + " " + str(self.tag))
+class MemoryHierarchySimulator:
+    def __init__(self, config, output=None, interval=None, profile=False):
+        self.interval = interval
+        if isinstance(config, dict):
+            config = Config(values=config, verbose=False)
+        self.config = config
+        self.stats = Statistics(self.config)
+        self.pagetable = PageTable(self.stats, self.config)
+        self.tlb = TLB(self.stats, self.config)
+        self.pipeline = TraceData(self.config, None, self.stats, self.pagetable,
+                                  self.tlb, output)
+        # per-window counters every interval accesses
+        self.windows = None
+        if interval:
+            self.windows = IntervalStats(self.stats, interval)
+            self.pipeline.windows = self.windows
+        # StageProfiler timing each stage of the access path, or None
+        self.profiler = None
+        if profile:
+            self.profiler = StageProfiler()
+            self.profiler.attach(self.pipeline)
+
+    """simulates a trace and returns the statistics so far
+       trace is a file name, a Trace/BinaryTrace, or an iterable of
+       accesses given as 'R:addr' strings or (type, address) pairs"""
+    def run(self, trace, invalidations=None, start=0):
+        if invalidations:
+            self.pipeline.invalidations.extend(invalidations)
+        trace = as_trace(trace)
+        if start:
+            trace = skip_accesses(trace, start)
+        if self.profiler is not None:
+            self.profiler.measure(self.pipeline.run, trace)
+        else:
+            self.pipeline.run(trace)
+        return self.stats
+
+    """saves the whole state to path, every accesses during later runs
+       as well if given"""
+    def checkpoint(self, path, every=None):
+        if every:
+            self.pipeline.checkpoints = Checkpointer(self, path, every)
+        Checkpoint.save(self, path)
+
+    """loads the state saved by checkpoint, see Checkpoint.load"""
+    def restore(self, path, warm=False):
+        Checkpoint.load(self, path, warm)
+        if self.windows is not None:
+            self.windows = IntervalStats(self.stats, self.interval, self.pipeline.position)
+            self.pipeline.windows = self.windows
+        return self
+
+    """restores a checkpoint and simulates the rest of its trace"""
+    def resume(self, path, trace):
+        self.restore(path)
+        return self.run(trace, start=self.pipeline.position)
+
+    """simulates only the accesses appended to a growing trace file since
+       the last call with the same state file, which keeps the whole state
+       in between. A text trace is read on from the byte offset after the
+       last whole line, a binary one from the record at the trace position"""
+    def append(self, path, trace_file):
+        if os.path.exists(path):
+            self.restore(path)
+        if BinaryTrace.is_binary(trace_file):
+            trace = BinaryTrace(trace_file, start=self.pipeline.position)
+            self.run(trace)
+        else:
+            trace = Trace(trace_file, offset=self.pipeline.offset, follow=True)
+            # the offset is into the decompressed text of a compressed trace
+            assert trace.codec is not None or \
+                   os.path.getsize(trace_file) >= self.pipeline.offset, \
+            trace_file + " is shorter than when it was last simulated."
+            self.run(trace)
+            self.pipeline.offset = trace.end
+        self.checkpoint(path)
+        return self.stats
+
+
+"""turns any of the trace forms the simulator accepts into a chunk iterable"""
+def as_trace(trace, chunk_size=CHUNK_SIZE):
+    if isinstance(trace, (str, Path)):
+        return open_trace(str(trace), chunk_size)
+    if isinstance(trace, (Trace, BinaryTrace, PrefetchedTrace)):
+        return trace
+    return chunk_accesses(trace, chunk_size)
+
+
+"""generator turning single accesses into (writes, addresses) chunks"""
+def chunk_accesses(accesses, chunk_size=CHUNK_SIZE):
+    writes = list()
+    addresses = list()
+    for access in accesses:
+        if isinstance(access, str):
+            kind, address = access.strip().split(":")
+            address = int(address, 16)
+        else:
+            kind, address = access
+        writes.append(kind == "W" or kind is True or kind == 1)
+        addresses.append(address)
+        if len(addresses) == chunk_size:
+            yield writes, addresses
+            writes = list()
+            addresses = list()
+    if addresses:
+        yield writes, addresses
+
+
+"""generator dropping the first start accesses of a chunk iterable"""
+def skip_accesses(trace, start):
+    for writes, addresses in trace:
+        if start >= len(addresses):
+            start -= len(addresses)
+            continue
+        if start:
+            writes = writes[start:]
+            addresses = addresses[start:]
+            start = 0
+        yield writes, addresses
+
+
+"""runs one simulation without any output and returns its counters"""
+def simulate(config, trace_file, invalidations=None):
+    return MemoryHierarchySimulator(config).run(trace_file, invalidations).counters()
 
 
 """
-    Data cache for computing tag/ind/hits/misses
+    On-disk cache of simulation results
+    counters are stored under a digest of every config value and of the
+    trace (the header digest of a binary trace, the file contents of a
+    text one) in one JSON index kept in least recently used order and cut
+    to max_entries. The index records a digest of the simulator source,
+    and a different simulator empties the cache. Lookups and new results
+    change the index in memory only, save writes it back once per run
 """
-class DataCache:
-    def __init__(self, stats, config, data):
+class ResultCache:
+    INDEX = 'results.json'
+
+    def __init__(self, directory, max_entries=1024):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.path = os.path.join(directory, self.INDEX)
+        with open(os.path.abspath(__file__), 'rb') as f:
+            self.version = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+        self.entries = dict()
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                index = json.load(f)
+            if index.get('version') == self.version:
+                self.entries = index['entries']
+        # (path, size, mtime) of a trace file -> its digest
+        self.digests = dict()
+
+    """digest of a trace file's accesses, worked out once per version of
+       the file"""
+    def trace_digest(self, trace_file):
+        st = os.stat(trace_file)
+        version = (os.path.abspath(trace_file), st.st_size, st.st_mtime_ns)
+        if version not in self.digests:
+            self.digests[version] = self.hash_trace(trace_file)
+        return self.digests[version]
+
+    @staticmethod
+    def hash_trace(trace_file):
+        if BinaryTrace.is_binary(trace_file):
+            trace = BinaryTrace(trace_file)
+            return 'binary:%d:%s' % (trace.count, trace.digest.hex())
+        digest = hashlib.blake2b(digest_size=16)
+        with open(trace_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return 'text:' + digest.hexdigest()
+
+    """the cache key of one config and trace file"""
+    def key(self, config, trace_file):
+        values = json.dumps(config.values(), sort_keys=True)
+        return hashlib.blake2b((values + self.trace_digest(trace_file)).encode(),
+                               digest_size=16).hexdigest()
+
+    """the stored result for key, or None"""
+    def get(self, key):
+        result = self.entries.pop(key, None)
+        if result is not None:
+            # back to the most recently used end
+            self.entries[key] = result
+        return result
+
+    def put(self, key, result):
+        self.entries.pop(key, None)
+        self.entries[key] = result
+        while len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+
+    def clear(self):
+        self.entries = dict()
+        self.save()
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'version': self.version, 'entries': self.entries}, f)
+        os.replace(tmp, self.path)
+
+
+"""
+    Parameter sweep over a grid of config values
+    every combination of the grid is applied to the base config and
+    simulated in a pool of worker processes, and the counters of all the
+    runs are collected into one result table
+"""
+class ParameterSweep:
+    def __init__(self, config, trace_file, grid, jobs=None, cache=None):
+        self.config = config
+        self.trace_file = trace_file
+        """config value name -> list of values to try"""
+        self.grid = grid
+        self.jobs = jobs
+        """ResultCache consulted before simulating a point, or None"""
+        self.cache = cache
+        self.rows = list()
+
+    """yields (grid values, config) for every point of the grid"""
+    def configs(self):
+        names = list(self.grid)
+        for values in itertools.product(*[self.grid[n] for n in names]):
+            point = dict(zip(names, values))
+            yield point, self.config.variant(**point)
+
+    def run(self):
+        try:
+            self.simulate()
+        finally:
+            if self.cache is not None:
+                self.cache.save()
+        return self.rows
+
+    """simulates every point the cache does not have in the worker pool"""
+    def simulate(self):
+        with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+            futures = list()
+            for point, config in self.configs():
+                key = None
+                if self.cache is not None:
+                    key = self.cache.key(config, self.trace_file)
+                    counters = self.cache.get(key)
+                    if counters is not None:
+                        futures.append((point, key, counters))
+                        continue
+                futures.append((point, key, pool.submit(simulate, config, self.trace_file)))
+            for point, key, future in futures:
+                row = dict(point)
+                if isinstance(future, dict):
+                    row.update((name, future[name]) for name in Statistics.COUNTERS)
+                else:
+                    row.update(future.result())
+                    if key is not None:
+                        self.cache.put(key, future.result())
+                self.rows.append(row)
+
+    """writes the result table as json or, for any other extension, csv"""
+    def write_results(self, path):
+        with open(path, 'w', newline='') as f:
+            if path.endswith('.json'):
+                json.dump(self.rows, f, indent=1)
+            else:
+                writer = csv.DictWriter(f, fieldnames=list(self.grid) + Statistics.COUNTERS)
+                writer.writeheader()
+                writer.writerows(self.rows)
+
+
+"""
+    Set-partitioned simulation of one configuration
+    translation runs once in this process, then the physical address
+    stream is split on index bits that the D-cache and L2 set indices
+    share, so every DC set and every L2 set lands in exactly one
+    partition. Each partition is simulated as a physical-only trace in a
+    worker process and the counters are added back together
+"""
+class PartitionedSimulation:
+    def __init__(self, config, trace, stats, pt, tlb, partitions, jobs=None):
+        # walks read the caches of every partition in trace order
+        assert not config.page_walk_levels, \
+        "A partitioned simulation does not model page walks."
+        # one generator per tag store draws in trace order across all sets
+        assert config.replacement_datacache != 'random' and \
+               config.replacement_l2cache != 'random', \
+        "A partitioned simulation needs a deterministic replacement policy."
         self.config = config
-        self.data = data
         self.stats = stats
-        self.l2 = L2Cache(self.stats, self.config)
-        self.assoc = int(config.set_size_datacache)
-        self.size = int(config.num_sets_datacache)
-        self.entries = []
-        self.init_cache()
+        self.jobs = jobs
+        self.pipeline = TraceData(config, trace, stats, pt, tlb)
+
+        # index bits common to both caches (just the dc's without an l2)
+        lo = config.offset_datacache
+        hi = config.offset_datacache + config.index_datacache
+        if config.l2_cache:
+            lo = max(lo, config.offset_l2cache)
+            hi = min(hi, config.offset_l2cache + config.index_l2cache)
+        self.shift = lo
+        bits = min(max(0, hi - lo), int(math.log(partitions, 2)))
+        self.partitions = 2 ** bits
+
+    """translates the trace and writes one binary trace per partition,
+       returns the files and each partition's page replacement events"""
+    def split(self, directory):
+        writers = [BinaryTraceWriter(os.path.join(directory, 'part%d.bin' % p))
+                   for p in range(self.partitions)]
+        # a replaced page may have lines in every partition, so each one
+        # gets the event at its own position in its stream
+        events = [list() for p in range(self.partitions)]
+        mask = self.partitions - 1
+        for writes, addresses in self.pipeline.trace:
+            phys = self.pipeline.translate(addresses)[-1]
+            replaced = self.pipeline.replaced
+            if self.partitions == 1:
+                for i, frame in replaced:
+                    events[0].append((writers[0].count + i, frame))
+                writers[0].write(writes, phys)
+            elif np is not None:
+                phys = np.asarray(phys, dtype=np.uint64)
+                writes = np.asarray(writes, dtype=np.uint8)
+                keys = (phys >> np.uint64(self.shift)) & np.uint64(mask)
+                for p in range(self.partitions):
+                    sel = np.flatnonzero(keys == p)
+                    if replaced:
+                        pos = np.searchsorted(sel, [i for i, frame in replaced]).tolist()
+                        for q, (i, frame) in zip(pos, replaced):
+                            events[p].append((writers[p].count + q, frame))
+                    writers[p].write(writes[sel], phys[sel])
+            else:
+                parts = [(list(), list()) for p in range(self.partitions)]
+                replaced = dict(replaced)
+                for i in range(len(phys)):
+                    if i in replaced:
+                        for p in range(self.partitions):
+                            events[p].append((writers[p].count + len(parts[p][1]), replaced[i]))
+                    part = parts[(phys[i] >> self.shift) & mask]
+                    part[0].append(writes[i])
+                    part[1].append(phys[i])
+                for p in range(self.partitions):
+                    writers[p].write(*parts[p])
+        for w in writers:
+            w.close()
+        return [w.trace_file for w in writers], events
+
+    def run(self):
+        # the partitions are already physical addresses
+        phys_config = self.config.variant(virtual_address=False, tlb=False)
+        with tempfile.TemporaryDirectory() as directory:
+            files, events = self.split(directory)
+            with ProcessPoolExecutor(max_workers=self.jobs) as pool:
+                results = list(pool.map(simulate, [phys_config] * len(files), files, events))
+        # translation counters are in self.stats already, the workers only
+        # count cache and memory activity
+        for counters in results:
+            for name in Statistics.COUNTERS:
+                setattr(self.stats, name, getattr(self.stats, name) + counters[name])
 
-    def init_cache(self):
-        for i in range(self.size):
-            dum = list()
-            for j in range(self.assoc):
-                dum.append(DataCacheEntry(0, -1, -1))
-            self.entries.append(dum)
+
+"""
+    Sampled simulation of a long trace
+    out of every period accesses the first window are simulated in full
+    and measured, the rest only warm the TLB, page table and caches
+    (functional warming), so every detailed window starts from the exact
+    state a full run would have. The per-window counters give estimates
+    of the full-trace statistics with 95% confidence intervals
+"""
+class SampledSimulation:
+    """z value of a two sided 95% confidence interval"""
+    Z = 1.96
+    """(name, hits, misses) of the ratios estimated per window"""
+    RATIOS = [('dtlb hit ratio', 'dtlb_hits', 'dtlb_misses'),
+              ('pt hit ratio', 'pt_hits', 'pt_faults'),
+              ('dc hit ratio', 'dc_hits', 'dc_misses'),
+              ('L2 hit ratio', 'l2_hits', 'l2_misses'),
+              ('Ratio of reads', 'total_reads', 'total_writes')]
+
+    def __init__(self, config, trace, stats, pt, tlb, period, window, output=None):
+        assert 0 < window <= period, \
+        "The sample window has to be positive and no longer than the period."
+        self.config = config
+        self.stats = stats
+        self.period = period
+        self.window = window
+        self.pipeline = TraceData(config, trace, stats, pt, tlb, output)
+        self.accesses = 0
+        # counters of every complete detailed window
+        self.samples = list()
+
+    def run(self):
+        pipeline = self.pipeline
+        output = pipeline.output
+        if output is not None:
+            output.header()
+        # position inside the current period
+        phase = 0
+        before = self.stats.counters()
+        for writes, addresses in pipeline.trace:
+            start = 0
+            while start < len(addresses):
+                detailed = phase < self.window
+                end = self.window if detailed else self.period
+                step = min(len(addresses) - start, end - phase)
+                piece = writes[start:start + step], addresses[start:start + step]
+                if detailed:
+                    rows = pipeline.calculate_all(*piece)
+                    if output is not None:
+                        output.write_chunk(rows, pipeline.invalidated)
+                else:
+                    pipeline.warm(*piece)
+                start += step
+                phase += step
+                if phase == self.window:
+                    after = self.stats.counters()
+                    self.samples.append(dict((name, after[name] - before[name])
+                                             for name in Statistics.COUNTERS))
+                    before = after
+                if phase == self.period:
+                    phase = 0
+            self.accesses += len(addresses)
+        if output is not None:
+            output.close()
+
+    """mean and 95% half-width of a list of per-window values"""
+    def interval(self, values):
+        n = len(values)
+        mean = sum(values) / n
+        if n < 2:
+            return mean, float('nan')
+        var = sum((v - mean) ** 2 for v in values) / (n - 1)
+        return mean, self.Z * math.sqrt(var / n)
+
+    """estimated full-trace counter totals and ratios, as
+       name -> (estimate, half-width)"""
+    def estimates(self):
+        res = dict()
+        for name in Statistics.COUNTERS:
+            mean, half = self.interval([s[name] / self.window for s in self.samples])
+            res[name] = (mean * self.accesses, half * self.accesses)
+        for label, hits, misses in self.RATIOS:
+            values = [float(s[hits]) / (s[hits] + s[misses])
+                      for s in self.samples if s[hits] + s[misses]]
+            if values:
+                res[label] = self.interval(values)
+        return res
+
+    def print_stats(self):
+        print("\nSampled simulation statistics\n")
+        print("accesses         : " + str(self.accesses))
+        print("detailed windows : %d of %d accesses every %d"
+              % (len(self.samples), self.window, self.period))
+        if not self.samples:
+            print("The trace is shorter than one detailed window.")
+            return
+        print("estimates with 95% confidence intervals\n")
+        res = self.estimates()
+        labels = {'dtlb_hits': 'dtlb hits', 'dtlb_misses': 'dtlb misses',
+                  'pt_hits': 'pt hits', 'pt_faults': 'pt faults',
+                  'dc_hits': 'dc hits', 'dc_misses': 'dc misses',
+                  'l2_hits': 'L2 hits', 'l2_misses': 'L2 misses',
+                  'total_reads': 'Total reads', 'total_writes': 'Total writes',
+                  'main_mem_refs': 'main memory refs', 'pt_refs': 'page table refs',
+                  'disk_refs': 'disk refs'}
+        for name in Statistics.COUNTERS:
+            print('%-17s: %.0f +- %.0f' % ((labels[name],) + res[name]))
+        print("")
+        for label, hits, misses in self.RATIOS:
+            if label in res:
+                print('%-17s: %6.6f +- %6.6f' % ((label,) + res[label]))
+            else:
+                print('%-17s: N/A' % label)
+
+
+"""parses a NAME=V1,V2,... grid option"""
+def grid_option(value):
+    name, values = value.split("=")
+    return name.strip(), [int(v) for v in values.split(",")]
+
+
+"""
+    Set-associative tag store shared by the data cache, L2 cache, TLB and
+    physical page table
+    tags live in one flat array indexed by set * assoc + way (-1 marks an
+    invalid way). The replacement policy is the hit, fill, victim and
+    demote methods; this class is true LRU, kept as a doubly linked list
+    per set so a hit or a replacement never has to walk the other ways,
+    and the subclasses below swap in the other policies
+"""
+class CacheArray:
+    """whether hitting the way the last access hit or filled changes nothing,
+       which lets a run of accesses to one line skip the lookup"""
+    REPEAT_HIT_FREE = True
+
+    def __init__(self, num_sets, assoc):
+        self.num_sets = int(num_sets)
+        self.assoc = int(assoc)
+        self.tags = array('q', [-1]) * (self.num_sets * self.assoc)
+        self.init_policy()
+        # tag pushed out by the last allocation, -1 if the way was free
+        self.evicted = -1
+
+    def init_policy(self):
+        size = self.num_sets * self.assoc
+        # neighbours of each way in the recency list, -1 past either end
+        self.older = array('i', range(-1, size - 1))
+        self.newer = array('i', range(1, size + 1))
+        self.older[0::self.assoc] = array('i', [-1]) * self.num_sets
+        self.newer[self.assoc - 1::self.assoc] = array('i', [-1]) * self.num_sets
+        # least and most recently used way of each set
+        self.lru = array('i', range(0, size, self.assoc))
+        self.mru = array('i', range(self.assoc - 1, size, self.assoc))
+
+    """the arrays holding the tags and replacement state of every set"""
+    def state(self):
+        return {'tags': self.tags, 'older': self.older, 'newer': self.newer,
+                'lru': self.lru, 'mru': self.mru}
+
+    """copies arrays from state back in, they must match the geometry"""
+    def restore(self, state):
+        for name, values in self.state().items():
+            assert len(state[name]) == len(values), "The cache geometry does not match."
+            values[:] = state[name]
 
     def print_cache(self):
-        for i in range(self.size):
+        for i in range(self.num_sets):
             print(i)
             for j in range(self.assoc):
-                print(self.entries[i][j])
+                tag = self.tags[i * self.assoc + j]
+                print(str(int(tag != -1)) + " " + str(tag))
             print("")
 
-    def do_cache(self):
-        # go through each address and see if in cache
-        dc_tg = []
-        dc_in = []
-        l2_tg = []
-        l2_in = []
+    """returns the position of tag in the set or -1"""
+    def find(self, ind, tag):
+        base = ind * self.assoc
+        try:
+            return self.tags.index(tag, base, base + self.assoc)
+        except ValueError:
+            return -1
+
+    """function to make a way the most recently used of its set"""
+    def touch(self, ind, pos):
+        mru = self.mru[ind]
+        if pos == mru:
+            return
+        older = self.older
+        newer = self.newer
+        o = older[pos]
+        n = newer[pos]
+        # unlink, pos is not the mru so it always has a newer neighbour
+        if o == -1:
+            self.lru[ind] = n
+        else:
+            newer[o] = n
+        older[n] = o
+        # relink at the mru end
+        older[pos] = mru
+        newer[pos] = -1
+        newer[mru] = pos
+        self.mru[ind] = pos
+
+    # a hit and a fill both make the way the most recently used
+    hit = touch
+    fill = touch
+
+    """the way to replace next in a set"""
+    def victim(self, ind):
+        return self.lru[ind]
+
+    """function to make a way the next one to be replaced in its set"""
+    def demote(self, ind, pos):
+        lru = self.lru[ind]
+        if pos == lru:
+            return
+        older = self.older
+        newer = self.newer
+        o = older[pos]
+        n = newer[pos]
+        # unlink, pos is not the lru so it always has an older neighbour
+        if n == -1:
+            self.mru[ind] = o
+        else:
+            older[n] = o
+        newer[o] = n
+        # relink at the lru end
+        newer[pos] = lru
+        older[pos] = -1
+        older[lru] = pos
+        self.lru[ind] = pos
+
+    """function to replace the victim way of a set with tag"""
+    def allocate(self, ind, tag):
+        pos = self.victim(ind)
+        self.evicted = self.tags[pos]
+        self.tags[pos] = tag
+        self.fill(ind, pos)
+        return pos
+
+    """looks tag up and updates recency, allocating on a miss if asked"""
+    def access(self, ind, tag, allocate=True):
+        pos = self.find(ind, tag)
+        if pos != -1:
+            self.hit(ind, pos)
+            return True
+        if allocate:
+            self.allocate(ind, tag)
+        else:
+            self.evicted = -1
+        return False
+
+    """function to drop a line and make its way the next to be filled"""
+    def invalidate(self, ind, tag):
+        pos = self.find(ind, tag)
+        if pos == -1:
+            return False
+        self.tags[pos] = -1
+        self.demote(ind, pos)
+        return True
 
-        for i in self.data:
-            # dc
-            self.calc_dc_tag(i)
-            self.calc_dc_index(i)
 
-            res_dc = self.find_in_cache(i)
-            if i.accesstype == "W":
-                self.stats.total_writes += 1
-            else:
-                self.stats.total_reads += 1
-            if res_dc:
-                i.dc_res = "hit "
+"""
+    First in, first out replacement
+    the LRU list in fill order: hits leave it alone
+"""
+class FIFOArray(CacheArray):
+    def hit(self, ind, pos):
+        pass
+
+
+"""
+    Tree pseudo-LRU replacement
+    assoc - 1 bits per set, bit-packed into 64-bit words. Node n of the
+    heap-ordered tree (root 1, children 2n and 2n+1, way w at leaf
+    assoc + w) points to the half holding the next victim; a hit or fill
+    turns every node on the way's path away from it
+"""
+class TreePLRUArray(CacheArray):
+    def init_policy(self):
+        assert math.log(self.assoc, 2).is_integer(), \
+        "Tree PLRU needs a power of 2 associativity."
+        self.words = (self.assoc - 1) // 64 + 1
+        self.bits = array('Q', [0]) * (self.num_sets * self.words)
+
+    def state(self):
+        return {'tags': self.tags, 'bits': self.bits}
+
+    def touch(self, ind, pos):
+        assoc = self.assoc
+        bits = self.bits
+        base = ind * self.words
+        node = pos - ind * assoc + assoc
+        while node > 1:
+            parent = node >> 1
+            i = base + (parent >> 6)
+            if node & 1:
+                bits[i] &= ~(1 << (parent & 63))
             else:
-                i.dc_res = "miss"
-
-                # l2 cache
-                self.calc_l2_tag(i)
-                self.calc_l2_index(i)
-                res_l2 = self.l2.find_in_cache(i)
-                if res_l2:
-                    i.l2_res = "hit "
-                    self.stats.l2_hits += 1
-                else:
-                    i.l2_res = "miss"
-                    self.stats.l2_misses += 1
-                    self.stats.main_mem_refs += 1
-                    
-            dc_tg.append(i.dc_tag)
-            dc_in.append(i.dc_ind)
-            l2_tg.append(i.l2_tag)
-            l2_in.append(i.l2_ind)
-        return dc_tg, dc_in, l2_tg, l2_in
-            
-    """tag for dc"""
-    def calc_dc_tag(self, val):
-        shift = config.offset_datacache + config.index_datacache
-        mask = sys.maxsize
-        mask = mask << shift
-        res = val.hexaddress & mask
-        res = res >> shift
-        val.dc_tag = res
-
-    """index for dc"""
-    def calc_dc_index(self, val):
-        shift = config.offset_datacache
-        mask = 2 ** config.index_datacache - 1
-        mask = mask << shift
-        res = val.hexaddress & mask
-        res = res >> shift
-        val.dc_ind = res
-
-    """tag for l2"""
-    def calc_l2_tag(self, val):
-        shift = config.offset_l2cache + config.index_l2cache
-        mask = sys.maxsize
-        mask = mask << shift
-        res = val.hexaddress & mask
-        res = res >> shift
-        val.l2_tag = res
-
-    """index for l2"""
-    def calc_l2_index(self, val):
-        shift = config.offset_l2cache
-        mask = 2 ** config.index_l2cache - 1
-        mask = mask << shift
-        res = val.hexaddress & mask
-        res = res >> shift
-        val.l2_ind = res
-        
-        
-    """given an address goes to the index and sees if tag matches"""
-    def find_in_cache(self, entry):
-        if entry.accesstype =="R":
-            cur = entry
-            d_set = self.entries[cur.dc_ind]
-            for i in d_set:
-                if i.v is 1 and cur.dc_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.dc_tag)
-                    self.stats.dc_hits += 1
-                    return True
+                bits[i] |= 1 << (parent & 63)
+            node = parent
 
-            self.stats.dc_misses += 1
+    hit = touch
+    fill = touch
 
-            replace_index, evicted = self.find_index_replace(d_set)
-            save = d_set[replace_index]
-            if evicted:
-                self.l2.add_evicted(save.l2_tag)
+    def victim(self, ind):
+        # free ways are filled first
+        pos = self.find(ind, -1)
+        if pos != -1:
+            return pos
+        assoc = self.assoc
+        bits = self.bits
+        base = ind * self.words
+        node = 1
+        while node < assoc:
+            node = 2 * node + ((bits[base + (node >> 6)] >> (node & 63)) & 1)
+        return ind * assoc + node - assoc
 
-            # found place to replace, get dc_tag and make sure lru is 0 and v is 1
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
-            d_set[replace_index].tag = cur.dc_tag
-            d_set[replace_index].l2_tag = cur.l2_tag
-#             if a block was evicted, store this value in the l2 cache
-            return False
-        
-        # WRITE BACK, WRITE ALLOCATE
-        elif self.config.write_back_datacache and entry.accesstype =="W":
-            cur = entry
-            d_set = self.entries[cur.dc_ind]
-            for i in d_set:
-                if i.v is 1 and cur.dc_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.dc_tag)
-                    stats.dc_hits += 1
-#                     replace_index, evicted = self.find_index_replace(d_set)
-#                     d_set[replace_index].tag = cur.dc_tag
-                    return True
+    def demote(self, ind, pos):
+        pass
 
-            stats.dc_misses += 1
-            
-            replace_index, evicted = self.find_index_replace(d_set)
-            save = d_set[replace_index]
-            if evicted:
-                self.l2.add_evicted(save.l2_tag)
-
-            # found place to replace, must get dc_tag and make sure lru is 0 and v is 1
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
-            d_set[replace_index].tag = cur.dc_tag
-            d_set[replace_index].l2_tag = cur.l2_tag
-            return False
-        
-        # WRITE THROUGH, NO WRITE ALLOCATE
-        elif not self.config.write_back_datacache and entry.accesstype =="W":
-            cur = entry
-            d_set = self.entries[cur.dc_ind]
-            for i in d_set:
-                if i.v is 1 and cur.dc_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.dc_tag)
-                    stats.dc_hits += 1
-                    replace_index, evicted = self.find_index_replace(d_set)
-                    # found place to replace, must get dc_tag and make sure lru is 0 and v is 1
-                    d_set[replace_index].v = 1
-                    d_set[replace_index].lru = 0
-                    d_set[replace_index].tag = cur.dc_tag
-                    d_set[replace_index].l2_tag = cur.l2_tag
-                    return True
 
-            replace_index, evicted = self.find_index_replace(d_set)
-            stats.dc_misses += 1
-            # found place to replace, must get dc_tag and make sure lru is 0 and v is 1
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
-            d_set[replace_index].l2_tag = cur.l2_tag
-            return False
-        
-    """function to increment all lru values and reset the one that was just used"""
-    def reset_and_inc(self, d_set, reset):
-        for i in d_set:
-            if i.v is 1:
-                if i.tag is reset:
-                    i.lru = 0
-                else:
-                    i.lru = i.lru + 1
-
-
-    """function to find index of replaceable value in the set"""
-    def find_index_replace(self, d_set):
-        ind = 0
-        # look for a spot that is not valid
-        for i in d_set:
-            if i.v is 1:
-                i.v = 0
-                return ind, False
-            ind += 1
-
-        # find greatest LRU value and return the index of it in the d_set
-        max_val = d_set[0]
-        max_ind = 0
-        
-        ind = 0
-        for i in d_set:
-            if i.lru > max_val.lru:
-                max_val = i
-                max_ind = ind
-            ind += 1
+"""
+    Static re-reference interval prediction (SRRIP)
+    a 2-bit re-reference prediction value per way, one byte each: fills
+    predict a long interval (2), hits a near one (0), and the victim is
+    the first way predicted distant (3) after ageing the set as needed
+"""
+class SRRIPArray(CacheArray):
+    # a hit after a fill moves the way from long to near
+    REPEAT_HIT_FREE = False
+
+    """byte tables adding 0-3 to every value, to age a set in one step"""
+    AGE = [bytes(min(v + age, 255) for v in range(256)) for age in range(4)]
+
+    def init_policy(self):
+        self.rrpv = bytearray([3]) * (self.num_sets * self.assoc)
+
+    def state(self):
+        return {'tags': self.tags, 'rrpv': self.rrpv}
+
+    def hit(self, ind, pos):
+        self.rrpv[pos] = 0
+
+    def fill(self, ind, pos):
+        self.rrpv[pos] = 2
+
+    def victim(self, ind):
+        pos = self.find(ind, -1)
+        if pos != -1:
+            return pos
+        base = ind * self.assoc
+        end = base + self.assoc
+        rrpv = self.rrpv
+        pos = rrpv.find(3, base, end)
+        if pos == -1:
+            # age the whole set until one way is distant
+            age = 3 - max(rrpv[base:end])
+            rrpv[base:end] = rrpv[base:end].translate(self.AGE[age])
+            pos = rrpv.find(3, base, end)
+        return pos
+
+    def demote(self, ind, pos):
+        self.rrpv[pos] = 3
 
-        return max_ind, True
 
-    
 """
-    L2 Cache entry class
+    Random replacement
+    free ways first, otherwise a way picked by a generator seeded per
+    array, so runs are repeatable; the generator state is part of the
+    checkpointed state
 """
-class L2CacheEntry:
-    def __init__(self, v, tag):
-        self.v = v
-        self.tag = tag
-        self.lru = 0
+class RandomArray(CacheArray):
+    SEED = 0
 
-    def __str__(self):
-        return str(str(self.v) + " " + str(self.tag))
+    def init_policy(self):
+        self.rng = random.Random(self.SEED)
 
-class L2Cache:
-    def __init__(self, stats, config):
-        self.config = config
-        self.stats = stats
-        self.assoc = int(config.set_size_l2cache)
-        self.size = int(config.num_sets_l2cache)
-        self.entries = []
-        self.init_cache()
+    def state(self):
+        return {'tags': self.tags, 'rng': array('Q', self.rng.getstate()[1])}
 
-    def init_cache(self):
-        for i in range(self.size):
-            dum = list()
-            for j in range(self.assoc):
-                dum.append(L2CacheEntry(0, -1))
-            self.entries.append(dum)
+    def restore(self, state):
+        assert len(state['tags']) == len(self.tags), "The cache geometry does not match."
+        self.tags[:] = state['tags']
+        self.rng.setstate((3, tuple(state['rng']), None))
 
-    def print_cache(self):
-        for i in range(self.size):
-            print(i)
-            for j in range(self.assoc):
-                print(self.entries[i][j])
-            print("")
+    def hit(self, ind, pos):
+        pass
 
-    """given an address goes to the index and sees if tag matches"""
-    def find_in_cache(self, entry):    
-        if entry.accesstype =="R":
-            cur = entry
-            d_set = self.entries[cur.l2_ind]
-            for i in d_set:
-                if i.v is 1 and cur.l2_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.l2_tag)
-                    return True
+    fill = hit
 
-            replace_index = self.find_index_replace(d_set)
+    def victim(self, ind):
+        pos = self.find(ind, -1)
+        if pos != -1:
+            return pos
+        return ind * self.assoc + self.rng.randrange(self.assoc)
 
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
-            d_set[replace_index].tag = cur.l2_tag
-            return False
-        
-        # WRITE BACK, WRITE ALLOCATE
-        elif self.config.write_back_datacache and entry.accesstype =="W":
-            cur = entry
-            d_set = self.entries[cur.l2_ind]
-            for i in d_set:
-                if i.v is 1 and cur.l2_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.l2_tag)
-#                     replace_index = self.find_index_replace(d_set)
-#                     d_set[replace_index].tag = cur.l2_tag
-                    return True
-            
-            replace_index = self.find_index_replace(d_set)
+    def demote(self, ind, pos):
+        pass
 
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
-            d_set[replace_index].tag = cur.l2_tag
-            return False
-        
-        # WRITE THROUGH, NO WRITE ALLOCATE
-        elif not self.config.write_back_datacache and entry.accesstype =="W":
-            cur = entry
-            d_set = self.entries[cur.l2_ind]
-            for i in d_set:
-                if i.v is 1 and cur.l2_tag == i.tag:
-                    self.reset_and_inc(d_set, cur.l2_tag)
-                    stats.l2_hits += 1
-                    replace_index = self.find_index_replace(d_set)
-                    d_set[replace_index].v = 1
-                    d_set[replace_index].lru = 0
-                    d_set[replace_index].tag = cur.l2_tag
-                    return True
 
-            replace_index = self.find_index_replace(d_set)
-            d_set[replace_index].v = 1
-            d_set[replace_index].lru = 0
+"""replacement policy name -> tag store class"""
+POLICIES = {'lru': CacheArray, 'fifo': FIFOArray, 'plru': TreePLRUArray,
+            'srrip': SRRIPArray, 'random': RandomArray}
+
+
+"""
+    Hashed tag lookup for highly and fully associative tag stores
+    mixed in ahead of a policy class, it keeps a dict from set and tag to
+    the way holding it, and a count of free ways per set, so lookups,
+    fills and invalidations do not scan the set however many ways it has
+"""
+class HashedTags:
+    def init_policy(self):
+        super().init_policy()
+        # tag * num_sets + set -> position of every valid line
+        self.where = dict()
+        self.free = array('i', [self.assoc]) * self.num_sets
+
+    def restore(self, state):
+        super().restore(state)
+        self.where = dict()
+        self.free = array('i', [self.assoc]) * self.num_sets
+        for pos, tag in enumerate(self.tags):
+            if tag != -1:
+                ind = pos // self.assoc
+                self.where[tag * self.num_sets + ind] = pos
+                self.free[ind] -= 1
+
+    def find(self, ind, tag):
+        if tag != -1:
+            return self.where.get(tag * self.num_sets + ind, -1)
+        # a free way, only searched for while the set has one
+        if self.free[ind]:
+            return super().find(ind, -1)
+        return -1
+
+    def allocate(self, ind, tag):
+        pos = super().allocate(ind, tag)
+        if self.evicted == -1:
+            self.free[ind] -= 1
+        else:
+            del self.where[self.evicted * self.num_sets + ind]
+        self.where[tag * self.num_sets + ind] = pos
+        return pos
+
+    def invalidate(self, ind, tag):
+        pos = self.where.pop(tag * self.num_sets + ind, -1)
+        if pos == -1:
             return False
-    
-    """function to increment all lru values and reset the one that was just used"""
-    def reset_and_inc(self, d_set, reset):
-        for i in d_set:
-            if i.v is 1:
-                if i.tag is reset:
-                    i.lru = 0
-                else:
-                    i.lru = i.lru + 1
-
-
-    """function to find index of replaceable value in the set"""
-    def find_index_replace(self, d_set):
-        ind = 0
-        # look for a spot that is not valid
-        for i in d_set:
-            if i.v is 0:
-                i.v = 1
-                return ind
-            ind += 1
-
-        # find greatest LRU value and return the index of it in the d_set
-        max_val = d_set[0]
-        max_ind = 0
-        
-        ind = 0
-        for i in d_set:
-            if i.lru > max_val.lru:
-                max_val = i
-                max_ind = ind
-            ind += 1
-
-        return max_ind
-    
-    """function to add the value that is evicted from the data cache"""
-    def add_evicted(self, tag):
-        replace_ind = self.find_index_replace(self.entries[0])
-        self.entries[0][replace_ind].v = 1
-        self.entries[0][replace_ind].lru = 0
-        self.entries[0][replace_ind].tag = tag
+        self.tags[pos] = -1
+        self.free[ind] += 1
+        self.demote(ind, pos)
+        return True
+
+
+"""ways above which a tag store switches to hashed lookup, below it a
+   scan of the set in C is faster than a dict"""
+HASH_WAYS = 32
+
+"""policy class -> its hashed variant"""
+HASHED = dict()
+
+"""makes the tag store for a replacement policy and geometry"""
+def cache_array(policy, num_sets, assoc):
+    cls = POLICIES[policy]
+    if int(assoc) > HASH_WAYS:
+        if cls not in HASHED:
+            HASHED[cls] = type('Hashed' + cls.__name__, (HashedTags, cls), {})
+        cls = HASHED[cls]
+    return cls(num_sets, assoc)
 
 
 """
-    Physical page table entries class
-    done in a round robin fashion
-    LRU replacement
+    Data cache for computing tag/ind/hits/misses
 """
-class PhysicalPage:
-    def __init__(self):
-        self.v = 0
-        self.lru = 0
-        self.init_accesses = 0
+class DataCache:
+    def __init__(self, stats, config):
+        self.config = config
+        self.stats = stats
+        self.l2 = L2Cache(self.stats, self.config)
+        self.decoder = AddressDecoder(self.config)
+        self.assoc = int(config.set_size_datacache)
+        self.size = int(config.num_sets_datacache)
+        self.lines = cache_array(config.replacement_datacache, self.size, self.assoc)
+        """PageWalk reading the ptes of a walk, set by the pipeline"""
+        self.walker = None
+
+    def print_cache(self):
+        self.lines.print_cache()
+
+    """runs a chunk of decoded accesses through the dc and l2
+       events are the (index, frame) page replacements of the chunk, whose
+       lines are invalidated just before that access"""
+    def do_cache(self, writes, dc_tag, dc_ind, l2_tag, l2_ind, events=(), walks=()):
+        dc_res = [""] * len(writes)
+        l2_res = [""] * len(writes)
+        invalidated = dict()
+        stats = self.stats
+        ev = 0
+        next_ev = events[0][0] if events else -1
+        wk = 0
+        next_wk = walks[0][0] if walks else -1
+        # line the last access left in the dc, when hitting it again can
+        # skip the lookup; page walks and invalidations forget it
+        same_line = self.lines.REPEAT_HIT_FREE
+        write_allocate = self.config.write_back_datacache
+        last_ind = -1
+        last_tag = -1
+
+        for i in range(len(writes)):
+            # the page walk reads its ptes before the access itself
+            if i == next_wk:
+                self.walker.read(self, walks[wk][1])
+                wk += 1
+                next_wk = walks[wk][0] if wk < len(walks) else -1
+                last_tag = -1
+            while i == next_ev:
+                frame = events[ev][1]
+                invalidated[i] = (frame, self.invalidate_frame(frame))
+                ev += 1
+                next_ev = events[ev][0] if ev < len(events) else -1
+                last_tag = -1
+
+            write = writes[i]
+            if write:
+                stats.total_writes += 1
+            else:
+                stats.total_reads += 1
+
+            # dc
+            ind = dc_ind[i]
+            tag = dc_tag[i]
+            if tag == last_tag and ind == last_ind:
+                stats.dc_hits += 1
+                dc_res[i] = "hit "
+                l2_tag[i] = ""
+                l2_ind[i] = ""
+                continue
+            if self.find_in_cache(ind, tag, write):
+                dc_res[i] = "hit "
+                # l2 is not consulted on a dc hit
+                l2_tag[i] = ""
+                l2_ind[i] = ""
+                if same_line:
+                    last_ind = ind
+                    last_tag = tag
+                continue
+            dc_res[i] = "miss"
+            # a miss leaves the line behind unless it was a write not allocated
+            if same_line and (write_allocate or not write):
+                last_ind = ind
+                last_tag = tag
+            else:
+                last_tag = -1
+
+            # l2 cache, or straight to memory when it is disabled
+            if not self.config.l2_cache:
+                l2_tag[i] = ""
+                l2_ind[i] = ""
+                stats.main_mem_refs += 1
+            elif self.l2.find_in_cache(l2_ind[i], l2_tag[i], write):
+                l2_res[i] = "hit "
+                stats.l2_hits += 1
+            else:
+                l2_res[i] = "miss"
+                stats.l2_misses += 1
+                stats.main_mem_refs += 1
+        return dc_res, l2_res, invalidated
+
+    """same cache updates as do_cache without counting or results,
+       for functional warming"""
+    def warm(self, writes, dc_tag, dc_ind, l2_tag, l2_ind, events=(), walks=()):
+        dc = self.lines.access
+        l2 = self.l2.lines.access
+        dc_wb = self.config.write_back_datacache
+        l2_wb = self.config.write_back_l2cache
+        l2_on = self.config.l2_cache
+        ev = 0
+        next_ev = events[0][0] if events else -1
+        wk = 0
+        next_wk = walks[0][0] if walks else -1
+
+        for i in range(len(writes)):
+            if i == next_wk:
+                self.walker.read(self, walks[wk][1], False)
+                wk += 1
+                next_wk = walks[wk][0] if wk < len(walks) else -1
+            while i == next_ev:
+                self.invalidate_frame(events[ev][1])
+                ev += 1
+                next_ev = events[ev][0] if ev < len(events) else -1
+            write = writes[i]
+            if dc(dc_ind[i], dc_tag[i], dc_wb or not write):
+                continue
+            if l2_on:
+                l2(l2_ind[i], l2_tag[i], l2_wb or not write)
+
+    """invalidates the dc and l2 lines of a replaced physical page,
+       returns (cache, tag, index) of every line that was present"""
+    def invalidate_frame(self, frame):
+        res = list()
+        d = self.decoder
+        base = frame << self.config.offset_pt
+        end = base + self.config.page_size
+        for addr in range(base, end, self.config.line_size_datacache):
+            tag = addr >> d.dc_tag_shift
+            ind = (addr >> d.dc_shift) & d.dc_mask
+            if self.lines.invalidate(ind, tag):
+                res.append(("DC", tag, ind))
+        if self.config.l2_cache:
+            line = self.config.line_size_l2cache
+            for addr in range(base - base % line, end, line):
+                tag = addr >> d.l2_tag_shift
+                ind = (addr >> d.l2_shift) & d.l2_mask
+                if self.l2.lines.invalidate(ind, tag):
+                    res.append(("L2", tag, ind))
+        return res
+            
+    """given an address goes to the index and sees if tag matches"""
+    def find_in_cache(self, ind, tag, write):
+        # reads, and writes under write-back/write-allocate, allocate on a
+        # miss; write-through/no-write-allocate writes only update recency
+        allocate = not write or self.config.write_back_datacache
+        if self.lines.access(ind, tag, allocate):
+            self.stats.dc_hits += 1
+            return True
+        self.stats.dc_misses += 1
+        return False
+
+
+class L2Cache:
+    def __init__(self, stats, config):
+        self.config = config
+        self.stats = stats
+        self.assoc = int(config.set_size_l2cache)
+        self.size = int(config.num_sets_l2cache)
+        self.lines = cache_array(config.replacement_l2cache, self.size, self.assoc)
+
+    def print_cache(self):
+        self.lines.print_cache()
+
+    """given an address goes to the index and sees if tag matches"""
+    def find_in_cache(self, ind, tag, write):
+        allocate = not write or self.config.write_back_l2cache
+        return self.lines.access(ind, tag, allocate)
+
 
-        
 """
     Physical page table class
+    the frames are the ways of a single fully associative CacheArray set,
+    so LRU touch and replacement are O(1) (and the other replacement
+    policies apply too), and each frame's tag is the virtual page mapped
+    into it, which doubles as the frame -> vpn map
 """
 class PhysicalPageTable:
     def __init__(self, config):
         self.config = config
-        self.size = self.config.num_physical_pg
-        self.pages = list()
-        self.init_table()
-
-
-    def init_table(self):
-        for i in range(int(self.size)):
-            self.pages.append(PhysicalPage())
-
-    # find a page and return the page number
-    def find_page(self):
-        replace_page, evicted = self.find_index_replace()
-        return replace_page, evicted
-
-    """function to increment all lru values and reset the one that was just used"""
-    def inc(self):
-        for i in self.pages:
-            if i.v is 1:
-                i.lru = i.lru + 1
-
-
-    """function to find index of replaceable value in the set"""
-    def find_index_replace(self):
-        ind = 0
-        # look for a spot that is not valid
-        for i in self.pages:
-            if i.v is 0:
-                i.v = 1
-                return ind, False
-            ind += 1
-
-        # find greatest LRU value and return the index of it in the d_set
-        max_val = self.pages[0]
-        max_ind = 0
-
-        ind = 0
-        for i in self.pages:
-            if i.lru > max_val.lru:
-                max_val = i
-                max_ind = ind
-            ind += 1
-            
-        return max_ind, True
+        self.size = int(self.config.num_physical_pg)
+        self.frames = cache_array(self.config.replacement_pt, 1, self.size)
+
+    """function to record a use of a frame with the replacement policy"""
+    def touch(self, frame):
+        self.frames.hit(0, frame)
+
+    # take the victim frame for vpn, returns the frame and the virtual page
+    # that was replaced (-1 if the frame was free)
+    def find_page(self, vpn):
+        frame = self.frames.allocate(0, vpn)
+        return frame, self.frames.evicted
 
 
 """
-    virtual page table entry
+    Multi-level page walk model
+    the virtual page number is split over the levels of a radix table,
+    whose nodes are given physical addresses above the data frames as
+    the walks first reach them (so only touched nodes exist). Every walk
+    reads one 8 byte pte per level, either through the D-cache and L2 or
+    through a page walk cache with its own entries for each level, and a
+    read that misses everywhere goes to main memory
 """
-class PageTableEntry:
-    def __init__(self):
-        self.phys_page = -1
-        self.v = 0
+class PageWalk:
+    """per level counters, in print order"""
+    COUNTERS = ['refs', 'pwc_hits', 'dc_hits', 'l2_hits', 'mem_refs']
+    PTE_SIZE = 8
+
+    def __init__(self, stats, config):
+        self.stats = stats
+        self.config = config
+        self.levels = config.page_walk_levels
+        # vpn bits of each level, root first, the lower levels taking
+        # any bits that do not divide evenly
+        base, extra = divmod(config.index_pt, self.levels)
+        self.bits = [base] * (self.levels - extra) + [base + 1] * extra
+        self.shifts = [sum(self.bits[l + 1:]) for l in range(self.levels)]
+        # (level, vpn bits above the level) -> node address
+        self.nodes = dict()
+        self.next_node = config.num_physical_pg * config.page_size
+        self.pwc = None
+        if config.page_walk_cache == 'pwc':
+            self.pwc = CacheArray(self.levels, config.pwc_entries)
+        stats.walk = [dict((name, 0) for name in self.COUNTERS) for l in range(self.levels)]
+
+    """physical addresses of the pte read at each level for vpn"""
+    def addresses(self, vpn):
+        res = list()
+        for level in range(self.levels):
+            shift = self.shifts[level]
+            key = (level, vpn >> (shift + self.bits[level]))
+            node = self.nodes.get(key)
+            if node is None:
+                node = self.nodes[key] = self.next_node
+                self.next_node += self.PTE_SIZE << self.bits[level]
+            res.append(node + ((vpn >> shift) & ((1 << self.bits[level]) - 1)) * self.PTE_SIZE)
+        return res
+
+    """reads the ptes of one walk through dc, counting unless warming"""
+    def read(self, dc, addresses, count=True):
+        stats = self.stats
+        d = dc.decoder
+        for level in range(self.levels):
+            addr = addresses[level]
+            if self.pwc is not None:
+                where = 'pwc_hits' if self.pwc.access(level, addr // self.PTE_SIZE) else 'mem_refs'
+            elif dc.lines.access((addr >> d.dc_shift) & d.dc_mask, addr >> d.dc_tag_shift):
+                where = 'dc_hits'
+            elif self.config.l2_cache and \
+                 dc.l2.lines.access((addr >> d.l2_shift) & d.l2_mask, addr >> d.l2_tag_shift):
+                where = 'l2_hits'
+            else:
+                where = 'mem_refs'
+            if count:
+                stats.walk[level]['refs'] += 1
+                stats.walk[level][where] += 1
+                if where == 'mem_refs':
+                    stats.main_mem_refs += 1
+
+    """the radix nodes and page walk cache as arrays"""
+    def state(self):
+        res = {'node_level': array('q', [k[0] for k in self.nodes]),
+               'node_prefix': array('q', [k[1] for k in self.nodes]),
+               'node_addr': array('q', self.nodes.values()),
+               'next_node': array('q', [self.next_node])}
+        if self.pwc is not None:
+            for name, values in self.pwc.state().items():
+                res['pwc_' + name] = values
+        return res
+
+    def restore(self, state):
+        self.nodes = dict(zip(zip(state['node_level'], state['node_prefix']), state['node_addr']))
+        self.next_node = state['next_node'][0]
+        if self.pwc is not None:
+            self.pwc.restore(dict((name, state['pwc_' + name]) for name in self.pwc.state()))
+
+    def print_stats(self):
+        if self.pwc is not None:
+            print("\nPage walks (" + str(self.levels) + " levels, page walk cache)\n")
+        else:
+            print("\nPage walks (" + str(self.levels) + " levels, D-cache and L2)\n")
+        print("Level  Bits       Refs   PWC hits    DC hits    L2 hits  Mem refs")
+        for level in range(self.levels):
+            c = self.stats.walk[level]
+            print("%5d %5d %10d %10d %10d %10d %9d"
+                  % (level, self.bits[level], c['refs'], c['pwc_hits'], c['dc_hits'],
+                     c['l2_hits'], c['mem_refs']))
+        refs = sum(c['refs'] for c in self.stats.walk)
+        mem = sum(c['mem_refs'] for c in self.stats.walk)
+        walks = self.stats.pt_refs
+        if walks:
+            print("\nMemory refs per walk : %6.6f" % (float(mem) / walks))
+        print("PTE reads            : " + str(refs))
+
 
-        
 """
     virtual page table implementation
     will take a virtual address and convert it to a physical address
     with a member funciton
+    the table is sparse: only the virtual pages mapped right now have an
+    entry (vpn -> frame), so memory follows the resident pages rather
+    than the size of the 64-bit virtual address space
 """
 class PageTable:
     def __init__(self, stats, config):
         self.stats = stats
         self.config = config
-        self.size = int(self.config.num_virtual_pg)
-        self.entries = list()
+        # valid entries only, vpn -> physical page
+        self.entries = dict()
         # physical page table
         self.phys_table = PhysicalPageTable(self.config)
-        self.init_table()
-        self.invalid = list()
-
-    def init_table(self):
-        for i in range(self.size):
-            self.entries.append(PageTableEntry())
+        # TLB to shoot translations down in, set by the pipeline
+        self.tlb = None
+        # multi-level walk model, None when walks are not modelled
+        self.walker = None
+        if self.config.page_walk_levels:
+            self.walker = PageWalk(self.stats, self.config)
+            self.stats.walker = self.walker
+
+    """the valid entries as vpn and frame arrays"""
+    def state(self):
+        return {'vpn': array('q', self.entries.keys()),
+                'frame': array('q', self.entries.values())}
+
+    def restore(self, state):
+        self.entries = dict(zip(state['vpn'], state['frame']))
 
     # take the virtual address then see if it has a page table value,
     # if it doesn't have a value then go to page table and use find a page
     # to assign to it
-    def convert_to_phy(self, add):
-        bool_evic = 0
-        ppn = 0
-        # check if valid entry in vpt
-        # store the indexed value
-        if add.tlb_res == "miss":
-            self.stats.pt_refs += 1
-        entry = self.entries[add.virtual_pg_num]
+    # returns the physical address, the pt result, whether a physical
+    # page was replaced and the physical page number
+    # only accesses the tlb did not satisfy get here
+    def convert_to_phy(self, vpn, offset):
+        self.stats.pt_refs += 1
         
         # entry is valid, convert with the physical page instead of the virtual page #
-        if entry.v:
-            self.phys_table.inc()
-            # reset lru for this page number
-            self.phys_table.pages[entry.phys_page].lru = 0
-            add.pt_res = "hit "
-            if add.tlb_res == "miss":
-                self.stats.pt_hits += 1
-            bool_evic = 0
-            add = self.replace_virtual_num(entry.phys_page, add)
-            ppn = entry.phys_page
-            return add, bool_evic, ppn
+        if vpn in self.entries:
+            frame, bool_evic = self.map_page(vpn)
+            self.stats.pt_hits += 1
+            add = self.replace_virtual_num(frame, offset)
+            return add, "hit ", bool_evic, frame
 
         else:
-            add.pt_res = "miss"
-            entry.phys_page, evicted = self.phys_table.find_page()
-            
-            # find all virtual pages that have this phys_page and invalidate them
-            if evicted:
-                self.invalidate_pages(entry.phys_page)
-                bool_evic = 1
-
-            entry.v = 1
+            frame, bool_evic = self.map_page(vpn)
             self.stats.pt_faults += 1
             self.stats.disk_refs += 1
-            add = self.replace_virtual_num(entry.phys_page, add)
-            ppn = entry.phys_page
-            return add, bool_evic, ppn
+            add = self.replace_virtual_num(frame, offset)
+            return add, "miss", bool_evic, frame
+
+    # maps a virtual page to its frame, faulting it into the lru frame if
+    # needed, without counting anything; returns the frame and 1 if the
+    # frame was taken from another virtual page
+    def map_page(self, vpn):
+        frame = self.entries.get(vpn, -1)
+        if frame != -1:
+            self.phys_table.touch(frame)
+            return frame, 0
+
+        frame, old_vpn = self.phys_table.find_page(vpn)
+        self.entries[vpn] = frame
+        # the virtual page that had this phys_page loses its mapping
+        if old_vpn != -1:
+            self.invalidate_page(old_vpn)
+            return frame, 1
+        return frame, 0
         
     """
-        takes in page and shifts that and XOR's with the address space pertaining to the num
+        takes in page and shifts that and ORs in the page offset
     """
-    def replace_virtual_num(self, page, add):
-        shift = config.offset_pt
-        offset = add.pg_offset
-        new_add = (page << shift) | offset
-        return new_add
+    def replace_virtual_num(self, page, offset):
+        return (page << self.config.offset_pt) | offset
 
     """
-        takes in phys page number and goes through all pages and invalidates them
+        invalidates the mapping of a virtual page whose frame was replaced
     """
-    def invalidate_pages(self, page_num):
-        inv = 0
-        for i in self.entries:
-            if i.phys_page == page_num:
-                i.v = 0
-
-        
-"""
-    class for TLBEntry
-"""
-class TLBEntry:
-    def __init__(self):
-        self.v = 0
-        self.tag = -1
-        self.v_page = -1
-        self.phys_page = -1
+    def invalidate_page(self, vpn):
+        del self.entries[vpn]
+        # the tlb must not keep translating to the frame
+        if self.tlb is not None:
+            self.tlb.shootdown(vpn)
 
         
 """
@@ -1037,95 +2582,210 @@ class TLBEntry:
 class TLB:
     def __init__(self, stats, config):
         self.config = config
+        self.stats = stats
         self.assoc = int(config.set_size_dtlb)
         self.size = int(config.num_sets_dtlb)
-        self.entries = []
-        self.init_cache()
-
-    def init_cache(self):
-        for i in range(self.size):
-            dum = list()
-            for j in range(self.assoc):
-                dum.append(TLBEntry())
-            self.entries.append(dum)
-
-    """given an address goes to the index and sees if tag matches"""
-    def check_tlb(self, entry):
-        cur = entry
-        line = self.entries[cur.tlb_ind]
-        for i in line:
-            if i.v is 1 and cur.tlb_tag == i.tag:
-                # if is valid and tag matches, reset and inc other lru's
-                cur.tlb_res = "hit "
-                stats.dtlb_hits += 1
-                self.reset_and_inc(line, cur.tlb_tag)
-                return True
-
-        # if not TLB bring it in and remove other value
-        cur.tlb_res = "miss"
-        stats.dtlb_misses += 1
-        
-        replace_index, evicted = self.find_index_replace(line)
-        line[replace_index].v = 1
-        line[replace_index].lru = 0
-        line[replace_index].tag = cur.tlb_tag
-        line[replace_index].v_page = cur.virtual_pg_num
-
-        return False
-
-    """function to increment all lru values and reset the one that was just used"""
-    def reset_and_inc(self, d_set, reset):
-        for i in d_set:
-            if i.v is 1:
-                if i.tag is reset:
-                    i.lru = 0
-                else:
-                    i.lru = i.lru + 1
-
-    """function to find index of replaceable value in the set"""
-    def find_index_replace(self, d_set):
-        ind = 0
-        # look for a spot that is not valid
-        for i in d_set:
-            if i.v is 0:
-                i.v = 1
-                return ind, False
-            ind += 1
-
-        # find greatest LRU value and return the index of it in the d_set
-        max_val = d_set[0]
-        max_ind = 0
-        ind = 0
-        for i in d_set:
-            if i.lru > max_val.lru:
-                max_val = i
-                max_ind = ind
-            ind += 1
-
-        return max_ind, True
-
+        self.lines = cache_array(config.replacement_dtlb, self.size, self.assoc)
+        # physical page of the translation held in each way
+        self.frames = array('q', [-1]) * (self.size * self.assoc)
+        self.index_mask = 2 ** config.index_dtlb - 1
+
+    """given an address goes to the index and sees if tag matches,
+       returns the cached physical page or -1 on a miss"""
+    def check_tlb(self, ind, tag):
+        frame = self.translate(ind, tag)
+        if frame != -1:
+            self.stats.dtlb_hits += 1
+            return frame
+
+        # the translation is filled in once the page table has it
+        self.stats.dtlb_misses += 1
+        return -1
+
+    """looks a translation up without counting it"""
+    def translate(self, ind, tag):
+        pos = self.lines.find(ind, tag)
+        if pos == -1:
+            return -1
+        self.lines.hit(ind, pos)
+        return self.frames[pos]
+
+    """caches the translation of a page after a miss"""
+    def fill(self, ind, tag, frame):
+        self.frames[self.lines.allocate(ind, tag)] = frame
+
+    """drops the translation of a virtual page whose frame was replaced"""
+    def shootdown(self, vpn):
+        self.lines.invalidate(vpn & self.index_mask, vpn >> self.config.index_dtlb)
+
+    """the tag store and the cached physical pages"""
+    def state(self):
+        res = self.lines.state()
+        res['frame'] = self.frames
+        return res
+
+    def restore(self, state):
+        self.lines.restore(dict((name, state[name]) for name in self.lines.state()))
+        self.frames[:] = state['frame']
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    parser.add_argument(action='store', dest='config_file', help='The config file name.')
-    parser.add_argument(action='store', dest='trace_data', help='The trace data file name.')
+    parser.add_argument(action='store', dest='config_file', nargs='?', help='The config file name.')
+    parser.add_argument(action='store', dest='trace_data', nargs='?', help='The trace data file name.')
+    parser.add_argument('--sweep-sets', type=lambda v: [int(x) for x in v.split(',')],
+                        help='Comma separated D-cache set counts to sweep in one pass.')
+    parser.add_argument('--sweep-ways', type=int,
+                        help='Largest D-cache associativity to report in a sweep.')
+    parser.add_argument('--grid', action='append', type=grid_option, metavar='NAME=V1,V2',
+                        help='Config value to sweep over, e.g. num_sets_datacache=64,128. '
+                             'May be repeated; every combination is simulated.')
+    parser.add_argument('--jobs', type=int, help='Worker processes for a --grid sweep.')
+    parser.add_argument('--results', default='results.csv',
+                        help='Result table of a --grid sweep (.csv or .json).')
+    parser.add_argument('--partitions', type=int,
+                        help='Split one simulation into up to this many cache set '
+                             'partitions and simulate them in parallel.')
+    parser.add_argument('--output', choices=TraceOutput.MODES, default='full',
+                        help='Rows of the per-access table to write: all of them, every '
+                             'Nth (sample), only those with a miss, or none (stats).')
+    parser.add_argument('--sample-every', type=int, default=1000, metavar='N',
+                        help='Row interval of --output sample.')
+    parser.add_argument('--sample-period', type=int, metavar='N',
+                        help='Sampled simulation: simulate a detailed window at the '
+                             'start of every N accesses and only warm the state '
+                             'with the rest.')
+    parser.add_argument('--sample-window', type=int, default=10000, metavar='U',
+                        help='Accesses in each detailed window of --sample-period.')
+    parser.add_argument('--interval', type=int, metavar='N',
+                        help='Record the counters of every window of N accesses.')
+    parser.add_argument('--interval-file', default='intervals.csv',
+                        help='CSV file for the --interval windows.')
+    parser.add_argument('--profile', action='store_true',
+                        help='Time each stage of the access path and print a table.')
+    parser.add_argument('--checkpoint', metavar='PATH',
+                        help='Save the simulator state to PATH at the end of the run.')
+    parser.add_argument('--checkpoint-every', type=int, metavar='N',
+                        help='Also save the --checkpoint every N accesses.')
+    parser.add_argument('--resume', metavar='PATH',
+                        help='Restore a checkpoint and simulate the rest of the trace.')
+    parser.add_argument('--warm-start', metavar='PATH',
+                        help='Start from the TLB, page table and cache contents of a '
+                             'checkpoint, with the counters at zero.')
+    parser.add_argument('--append', metavar='PATH',
+                        help='Simulate only the accesses appended to the trace since '
+                             'the last --append run with the same state file PATH.')
+    parser.add_argument('--cache', metavar='DIR',
+                        help='Reuse the results of earlier stats-only runs of the same '
+                             'config and trace, kept in DIR.')
+    parser.add_argument('--cache-size', type=int, default=1024, metavar='N',
+                        help='Results kept in the --cache, least recently used go first.')
+    parser.add_argument('--clear-cache', action='store_true',
+                        help='Empty the --cache before running.')
+    parser.add_argument('--convert', nargs=2, metavar=('TEXT', 'BINARY'),
+                        help='Convert a text trace to the binary trace format and exit.')
 
     args = parser.parse_args()
+    if args.convert:
+        count = BinaryTrace.convert(*args.convert)
+        print("Wrote " + str(count) + " records to " + args.convert[1] + ".")
+        sys.exit(0)
+    if args.trace_data is None:
+        parser.error('the config file and trace data file are required')
+    if args.append and (args.resume or args.warm_start or args.checkpoint):
+        parser.error('--append keeps its own state, without --resume, --warm-start '
+                     'or --checkpoint')
+    # these modes print their own results and exit before a plain run's extras
+    if (args.grid or args.partitions or args.sample_period or args.sweep_sets or
+            args.sweep_ways) and (args.checkpoint or args.checkpoint_every or args.resume or
+                                  args.warm_start or args.interval or args.profile or
+                                  args.append):
+        parser.error('--checkpoint, --resume, --warm-start, --interval, --profile and '
+                     '--append only apply to a plain run, not to --grid, --partitions, '
+                     '--sample-period or --sweep-sets/--sweep-ways')
+    if args.checkpoint_every and not args.checkpoint:
+        parser.error('--checkpoint-every needs a --checkpoint path')
     config_file = args.config_file
     trace_data = args.trace_data
 
-    open("trace.log", "w").close()
-
     config_file = config_file #'trace.config'
     config = Config(config_file)
     trace = trace_data #'trace.dat'
-    stats = Statistics(config)
-    pagetable = PageTable(stats, config)
-    tlb = TLB(stats, config)
-    data = Trace(trace)
-    out = TraceData(config, data.data, stats, pagetable, tlb)
-    out.print_all()
+    output = None
+    if args.output != 'stats':
+        output = TraceOutput(config, args.output, args.sample_every)
+    sim = MemoryHierarchySimulator(config, output, args.interval, args.profile)
+    stats = sim.stats
+    pagetable = sim.pagetable
+    tlb = sim.tlb
+    cache = None
+    if args.cache:
+        cache = ResultCache(args.cache, args.cache_size)
+        if args.clear_cache:
+            cache.clear()
+    if args.grid:
+        sweep = ParameterSweep(config, trace, dict(args.grid), args.jobs, cache)
+        sweep.run()
+        sweep.write_results(args.results)
+        print("Wrote " + str(len(sweep.rows)) + " results to " + args.results + ".")
+        sys.exit(0)
+    data = open_trace(trace)
+    if args.partitions:
+        PartitionedSimulation(config, data, stats, pagetable, tlb,
+                              args.partitions, args.jobs).run()
+        stats.print_stats()
+        sys.exit(0)
+    if args.sample_period:
+        sampled = SampledSimulation(config, data, stats, pagetable, tlb,
+                                    args.sample_period, args.sample_window, output)
+        sampled.run()
+        sampled.print_stats()
+        sys.exit(0)
+    if args.sweep_sets or args.sweep_ways:
+        sweep = StackDistanceSweep(config, data, stats, pagetable, tlb,
+                                   args.sweep_sets or [config.num_sets_datacache],
+                                   args.sweep_ways or config.set_size_datacache)
+        sweep.run()
+        sweep.print_stats()
+        sys.exit(0)
+    # only a plain stats-only run from the start has a result to reuse
+    plain = not (output or args.interval or args.profile or args.checkpoint or
+                 args.resume or args.warm_start or args.append)
+    if cache is not None and plain:
+        key = cache.key(config, trace)
+        result = cache.get(key)
+        # a sweep stores the counters without the page walk statistics
+        if result is not None and 'walk' in result:
+            for name in Statistics.COUNTERS:
+                setattr(stats, name, result[name])
+            stats.walk[:] = result['walk']
+            cache.save()
+            print("Statistics from the result cache.")
+            stats.print_stats()
+            sys.exit(0)
+    start = 0
+    if args.resume:
+        sim.restore(args.resume)
+        start = sim.pipeline.position
+    elif args.warm_start:
+        sim.restore(args.warm_start, warm=True)
+    if args.checkpoint and args.checkpoint_every:
+        sim.pipeline.checkpoints = Checkpointer(sim, args.checkpoint, args.checkpoint_every)
+    if args.append:
+        sim.append(args.append, trace)
+    else:
+        sim.run(data, start=start)
+    if cache is not None and plain:
+        result = stats.counters()
+        result['walk'] = stats.walk
+        cache.put(key, result)
+        cache.save()
+    if args.checkpoint:
+        sim.checkpoint(args.checkpoint)
     stats.print_stats()
+    if sim.profiler is not None:
+        sim.profiler.print_stats()
+    if sim.windows is not None:
+        sim.windows.write_csv(args.interval_file)
 
 